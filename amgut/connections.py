@@ -26,6 +26,19 @@ class _LazyAgData(object):
         return getattr(self._ag_data_access, name)
 
 
+class _LazyAsyncAgData(object):
+    def __init__(self):
+        self._async_ag_data_access = None
+
+    def __getattr__(self, name):
+        if not self._async_ag_data_access:
+            from amgut.lib.data_access.ag_data_access import AsyncAGDataAccess
+
+            self._async_ag_data_access = AsyncAGDataAccess(ag_data)
+
+        return getattr(self._async_ag_data_access, name)
+
+
 class _LazyRedis(object):
     def __init__(self):
         self._redis = None
@@ -45,6 +58,7 @@ class _LazyRedis(object):
 
 
 ag_data = _LazyAgData()
+ag_data_async = _LazyAsyncAgData()
 redis = _LazyRedis()
 
-__all__ = ['ag_data', 'redis']
+__all__ = ['ag_data', 'ag_data_async', 'redis']
@@ -0,0 +1,62 @@
+-- Oct 18, 2026
+-- Keep the number of logins of each country in a summary table, so the map
+-- markers do not have to aggregate all of ag_login on every page
+
+CREATE TABLE ag.login_country_counts (
+	country              varchar(100)  NOT NULL,
+	num_logins           integer DEFAULT 0 NOT NULL,
+	CONSTRAINT pk_login_country_counts PRIMARY KEY ( country )
+ );
+
+COMMENT ON TABLE ag.login_country_counts IS 'Number of logins of each country, maintained by the triggers on ag_login';
+
+INSERT INTO ag.login_country_counts (country, num_logins)
+SELECT country, count(*) FROM ag.ag_login
+WHERE country IS NOT NULL
+GROUP BY country;
+
+-- Adds delta logins to the count of a country
+CREATE FUNCTION ag.add_login_country_count(country_name varchar, delta integer) RETURNS void AS $$
+BEGIN
+	IF country_name IS NULL THEN
+		RETURN;
+	END IF;
+	LOOP
+		UPDATE ag.login_country_counts SET num_logins = num_logins + delta
+		WHERE country = country_name;
+		EXIT WHEN FOUND;
+		-- First login of the country. Another transaction may be adding
+		-- it at the same time, in which case the update is tried again
+		BEGIN
+			INSERT INTO ag.login_country_counts (country, num_logins)
+			VALUES (country_name, delta);
+			EXIT;
+		EXCEPTION WHEN unique_violation THEN
+		END;
+	END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION ag.update_login_country_counts() RETURNS trigger AS $$
+BEGIN
+	IF TG_OP = 'INSERT' THEN
+		PERFORM ag.add_login_country_count(NEW.country, 1);
+	ELSIF TG_OP = 'DELETE' THEN
+		PERFORM ag.add_login_country_count(OLD.country, -1);
+	ELSE
+		PERFORM ag.add_login_country_count(OLD.country, -1);
+		PERFORM ag.add_login_country_count(NEW.country, 1);
+	END IF;
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER login_country_counts_insert AFTER INSERT ON ag.ag_login
+FOR EACH ROW EXECUTE PROCEDURE ag.update_login_country_counts();
+
+CREATE TRIGGER login_country_counts_delete AFTER DELETE ON ag.ag_login
+FOR EACH ROW EXECUTE PROCEDURE ag.update_login_country_counts();
+
+CREATE TRIGGER login_country_counts_update AFTER UPDATE OF country ON ag.ag_login
+FOR EACH ROW WHEN ( OLD.country IS DISTINCT FROM NEW.country )
+EXECUTE PROCEDURE ag.update_login_country_counts();
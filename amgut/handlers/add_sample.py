@@ -68,7 +68,7 @@ class AddSample(BaseHandler):
         else:
             env_sampled = None
 
-        ag_login_id = ag_data.get_user_for_kit(self.current_user)
+        ag_login_id = self.ag_login_id
 
         ag_data.logParticipantSample(ag_login_id, barcode, sample_site,
                                      env_sampled, sample_date,
@@ -87,8 +87,7 @@ class AddSample(BaseHandler):
                     form=form, page_type=self.page_type, message='')
 
     def build_form(self):
-        kit_id = self.current_user
-        ag_login_id = ag_data.get_user_for_kit(kit_id)
+        ag_login_id = self.ag_login_id
         kit_barcodes = ag_data.getAvailableBarcodes(ag_login_id)
 
         form = LogSample()
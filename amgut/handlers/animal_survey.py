@@ -11,12 +11,15 @@ from amgut.handlers.base_handlers import BaseHandler
 from amgut.lib.survey_supp import primary_animal_survey
 from amgut.lib.util import make_survey_class, store_survey
 from amgut.connections import ag_data, redis
+from amgut.lib.data_access.sql_connection import bind_transaction
 from amgut import text_locale, media_locale
 
 
 class AnimalSurveyHandler(BaseHandler):
-    animal_survey = make_survey_class(primary_animal_survey.groups[0],
-                                      survey_type='AnimalSurvey')
+    @property
+    def animal_survey(self):
+        return make_survey_class(primary_animal_survey.groups[0],
+                                 survey_type='AnimalSurvey')
 
     @authenticated
     def get(self):
@@ -31,9 +34,8 @@ class AnimalSurveyHandler(BaseHandler):
 
     @authenticated
     def post(self):
-        skid = self.current_user
         tl = text_locale['handlers']
-        ag_login_id = ag_data.get_user_for_kit(skid)
+        ag_login_id = self.ag_login_id
         ag_login_info = ag_data.get_login_info(ag_login_id)[0]
         animal_survey_id = self.get_argument('survey_id', None)
         sitebase = media_locale['SITEBASE']
@@ -86,12 +88,14 @@ class CheckParticipantName(WebSocketHandler, BaseHandler):
     @authenticated
     def on_message(self, msg):
         tl = text_locale['handlers']
-        skid = self.current_user
         participant_name = msg
 
-        ag_login_id = ag_data.get_user_for_kit(skid)
-        human_participants = ag_data.getHumanParticipants(ag_login_id)
-        animal_participants = ag_data.getAnimalParticipants(ag_login_id)
+        # Websocket messages don't go through BaseHandler._execute, so each
+        # message gets its own transaction here
+        with bind_transaction():
+            ag_login_id = self.ag_login_id
+            human_participants = ag_data.getHumanParticipants(ag_login_id)
+            animal_participants = ag_data.getAnimalParticipants(ag_login_id)
 
         if participant_name in (human_participants + animal_participants):
             # if the participant already exists in the system, fail nicely
@@ -1,10 +1,11 @@
 #!/usr/bin/env python
 
+from tornado import gen
 from tornado.web import authenticated
 from tornado.escape import json_encode, url_escape
 import logging
 
-from amgut.connections import ag_data
+from amgut.connections import ag_data_async
 from amgut.lib.mail import send_email
 from amgut.handlers.base_handlers import BaseHandler
 from amgut import media_locale, text_locale
@@ -21,17 +22,19 @@ class AuthBasehandler(BaseHandler):
 
 class AuthRegisterHandoutHandler(AuthBasehandler):
     """User Creation"""
+    @gen.coroutine
     def get(self):
-        kit_counts = ag_data.getMapMarkers()
-        countries = ag_data.get_countries()
+        kit_counts = yield ag_data_async.getMapMarkers()
+        countries = yield ag_data_async.get_countries()
         self.render("register_user.html",
                     kit_counts=kit_counts, loginerror='', countries=countries)
 
+    @gen.coroutine
     def post(self):
         # Check handout
         skid = self.get_argument("kit_id").strip()
         password = self.get_argument("password")
-        is_handout = ag_data.handoutCheck(skid, password)
+        is_handout = yield ag_data_async.handoutCheck(skid, password)
         if not is_handout:
             tl = text_locale['handlers']
             self.redirect(media_locale['SITEBASE'] +
@@ -49,11 +52,11 @@ class AuthRegisterHandoutHandler(AuthBasehandler):
             info[info_column] = self.get_argument(info_column, None)
 
         # create the user if needed
-        ag_login_id = ag_data.addAGLogin(
+        ag_login_id = yield ag_data_async.addAGLogin(
             info['email'], info['participantname'], info['address'],
             info['city'], info['state'], info['zip'], info['country'])
         # Create the kit and add the kit to the user
-        success = ag_data.registerHandoutKit(ag_login_id, skid)
+        success = yield ag_data_async.registerHandoutKit(ag_login_id, skid)
         if not success:
             self.redirect(media_locale['SITEBASE'] + '/db_error/?err=regkit')
             return
@@ -62,7 +65,7 @@ class AuthRegisterHandoutHandler(AuthBasehandler):
         self.set_current_user(skid)
         self.redirect(media_locale['SITEBASE'] + "/authed/portal/")
 
-        kitinfo = ag_data.getAGKitDetails(skid)
+        kitinfo = yield ag_data_async.getAGKitDetails(skid)
 
         # Email the verification code
         # send email after redirect since it takes so long
@@ -85,19 +88,19 @@ class AuthLoginHandler(AuthBasehandler):
     def get(self, *args, **kwargs):
         self.redirect(media_locale['SITEBASE'] + "/")
 
+    @gen.coroutine
     def post(self):
         skid = self.get_argument("skid", "").strip()
         password = self.get_argument("password", "")
         tl = text_locale['handlers']
 
-        is_handout = ag_data.handoutCheck(skid, password)
-        if is_handout:
+        kit_type, login = yield ag_data_async.check_login(skid, password)
+        if kit_type == 'handout':
             # have them register themselves
             self.redirect(media_locale['SITEBASE'] + '/?loginerror=' +
                           tl['REGISTER_KIT'])
             return
 
-        login = ag_data.authenticateWebAppUser(skid, password)
         if login:
             # everything good so log in
             self.set_current_user(skid)
@@ -106,7 +109,7 @@ class AuthLoginHandler(AuthBasehandler):
             return
         else:
             msg = tl['INVALID_KITID']
-            kit_counts = ag_data.getMapMarkers()
+            kit_counts = yield ag_data_async.getMapMarkers()
             self.render("index.html", user=None, loginerror=msg,
                         kit_counts=kit_counts)
             return
@@ -1,14 +1,26 @@
 import logging
+from functools import partial
 
+from tornado.stack_context import StackContext
 from tornado.web import RequestHandler, StaticFileHandler
 
 from amgut import media_locale, text_locale
 from amgut.connections import ag_data
 from amgut.lib.config_manager import AMGUT_CONFIG
+from amgut.lib.data_access.sql_connection import Transaction, bind_transaction
 from amgut.lib.mail import send_email
 
 
 class BaseHandler(RequestHandler):
+    def _execute(self, transforms, *args, **kwargs):
+        """Runs the request with its own database transaction
+
+        The transaction stays bound across all the callbacks of asynchronous
+        requests, so concurrent requests never share pending queries.
+        """
+        with StackContext(partial(bind_transaction, Transaction())):
+            super(BaseHandler, self)._execute(transforms, *args, **kwargs)
+
     def get_current_user(self):
         """Overrides default method of returning user currently connected"""
         skid = self.get_secure_cookie("skid")
@@ -18,6 +30,13 @@ class BaseHandler(RequestHandler):
         else:
             return skid.strip('" ')
 
+    @property
+    def ag_login_id(self):
+        """The login id of the kit of the current user"""
+        if not hasattr(self, '_ag_login_id'):
+            self._ag_login_id = ag_data.get_user_for_kit(self.current_user)
+        return self._ag_login_id
+
     def write_error(self, status_code, **kwargs):
         """Overrides the error page created by Tornado"""
         from traceback import format_exception
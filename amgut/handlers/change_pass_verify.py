@@ -1,8 +1,10 @@
 from urllib import unquote
 
+from tornado import gen
+
 from amgut.lib.mail import send_email
 from amgut.handlers.base_handlers import BaseHandler
-from amgut.connections import ag_data
+from amgut.connections import ag_data, ag_data_async
 from amgut import text_locale
 
 
@@ -28,6 +30,7 @@ class ChangePassVerifyHandler(BaseHandler):
                     result=result, message=None, kit_counts=kit_counts,
                     loginerror='')
 
+    @gen.coroutine
     def post(self):
         email = self.get_argument('email', None)
         kit_id = self.get_argument('kitid', None)
@@ -35,17 +38,19 @@ class ChangePassVerifyHandler(BaseHandler):
             email = unquote(email)
         new_password = self.get_argument('new_password', None)
         confirm_password = self.get_argument('confirm_password', None)
-        self.reset_pass_and_email(new_password, confirm_password, email,
-                                  kit_id)
+        yield self.reset_pass_and_email(new_password, confirm_password, email,
+                                        kit_id)
 
     def is_valid(self, email, kitid, passcode):
         return ag_data.ag_verify_kit_password_change_code(email, kitid,
                                                           passcode)
 
+    @gen.coroutine
     def reset_pass_and_email(self, new_password, confirm_password, email,
                              supplied_kit_id):
-        ag_data.ag_update_kit_password(supplied_kit_id, new_password)
-        kit_counts = ag_data.getMapMarkers()
+        yield ag_data_async.ag_update_kit_password(supplied_kit_id,
+                                                   new_password)
+        kit_counts = yield ag_data_async.getMapMarkers()
         tl = text_locale['handlers']
         MESSAGE = tl['CHANGE_PASS_BODY'] % supplied_kit_id
         try:
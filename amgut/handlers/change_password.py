@@ -1,8 +1,9 @@
 from urllib import unquote
+from tornado import gen
 from tornado.web import authenticated
 
 from amgut.handlers.base_handlers import BaseHandler
-from amgut.connections import ag_data
+from amgut.connections import ag_data, ag_data_async
 from amgut.lib.mail import send_email
 from amgut import text_locale
 
@@ -16,19 +17,22 @@ class ChangePasswordHandler(BaseHandler):
                     confirm_password=None, result='valid', message=None)
 
     @authenticated
+    @gen.coroutine
     def post(self):
         email = self.get_argument('email', None)
         if email is not None:
             email = unquote(email)
         new_password = self.get_argument('new_password', None)
         confirm_password = self.get_argument('confirm_password', None)
-        self.reset_pass_and_email(new_password, confirm_password, email,
-                                  self.current_user)
+        yield self.reset_pass_and_email(new_password, confirm_password, email,
+                                        self.current_user)
 
+    @gen.coroutine
     def reset_pass_and_email(self, new_password, confirm_password, email,
                              supplied_kit_id):
         tl = text_locale['handlers']
-        ag_data.ag_update_kit_password(supplied_kit_id, new_password)
+        yield ag_data_async.ag_update_kit_password(supplied_kit_id,
+                                                   new_password)
         MESSAGE = tl['CHANGE_PASS_BODY'] % supplied_kit_id
         try:
             send_email(MESSAGE, tl['CHANGE_PASS_SUBJECT'], email)
@@ -12,11 +12,6 @@ from amgut.lib.survey_supp import primary_human_survey
 from amgut.lib.mail import send_email
 
 
-phs_groups = primary_human_survey.groups
-surveys = [make_survey_class(group, survey_type='HumanSurvey')
-           for group in phs_groups]
-
-
 def build_consent_form(consent_info):
     tl = text_locale['new_participant.html']
     # build out the consent form
@@ -106,6 +101,9 @@ class HumanSurveyHandler(BaseHandler):
             redis.expire(human_survey_id, 86400)
 
         next_page_number = page_number + 1
+        phs_groups = primary_human_survey.groups
+        surveys = [make_survey_class(group, survey_type='HumanSurvey')
+                   for group in phs_groups]
 
         if page_number >= 0:
             form_data = surveys[page_number]()
@@ -48,7 +48,7 @@ class NewParticipantHandler(BaseHandler):
                         message=tl['MISSING_NAME_EMAIL'])
             return
 
-        ag_login_id = ag_data.get_user_for_kit(self.current_user)
+        ag_login_id = self.ag_login_id
 
         # If the participant already exists, stop them outright
         if ag_data.check_if_consent_exists(ag_login_id, participant_name):
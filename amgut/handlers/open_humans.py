@@ -52,7 +52,7 @@ class OpenHumansHandler(BaseHandler, OpenHumansMixin, OriginMixin):
         # If the user isn't authenticated render the page to allow them to
         # authenticate
         if not open_humans:
-            ag_login_id = ag_data.get_user_for_kit(self.current_user)
+            ag_login_id = self.ag_login_id
             human_participants = ag_data.getHumanParticipants(ag_login_id)
 
             survey_ids = {}
@@ -112,7 +112,7 @@ class OpenHumansHandler(BaseHandler, OpenHumansMixin, OriginMixin):
 
         survey_ids = {}
 
-        ag_login_id = ag_data.get_user_for_kit(self.current_user)
+        ag_login_id = self.ag_login_id
         human_participants = ag_data.getHumanParticipants(ag_login_id)
 
         for participant_name in human_participants:
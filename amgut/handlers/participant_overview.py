@@ -14,13 +14,10 @@ class ParticipantOverviewHandler(BaseHandler):
         text = text_locale['participant_overview.html']
         participant_name = participant_name.strip('/')  # for nginx
         skid = self.current_user
-        ag_login_id = ag_data.get_user_for_kit(skid)
+        ag_login_id = self.ag_login_id
         barcodes = ag_data.getParticipantSamples(ag_login_id, participant_name)
-        if barcodes:
-            ebi_submitted = any(ag_data.is_deposited_ebi(b['barcode'])
-                                for b in barcodes)
-        else:
-            ebi_submitted = False
+        ebi_submitted = any(ag_data.deposited_ebi_many(
+            b['barcode'] for b in barcodes).values())
 
         # Check if we have to remove the participant
         participant_to_remove = self.get_argument("remove", None)
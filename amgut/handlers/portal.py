@@ -1,36 +1,37 @@
+from tornado import gen
 from tornado.web import authenticated
 
 from amgut import media_locale, text_locale
 from amgut.lib.mail import send_email
 from amgut.handlers.base_handlers import BaseHandler
-from amgut.connections import ag_data
+from amgut.connections import ag_data, ag_data_async
 
 
 class PortalHandler(BaseHandler):
     @authenticated
+    @gen.coroutine
     def get(self):
         errmsg = self.get_argument('errmsg', "")
         kit_id = self.current_user
 
-        user_info = ag_data.get_user_info(kit_id)
-
-        if not user_info:
+        try:
+            portal_data = yield ag_data_async.get_portal_data(kit_id)
+        except ValueError:
             self.redirect(media_locale['SITEBASE'] + '/auth/logout/')
             return
 
-        user_name = user_info['name']
-
-        kit_details = ag_data.getAGKitDetails(kit_id)
+        user_name = portal_data['user_info']['name']
+        kit_details = portal_data['kit_details']
         kit_verified = True if kit_details['kit_verified'] == 'y' else False
 
-        results = ag_data.get_barcode_results(kit_id)
+        results = portal_data['results']
         has_results = len(results) != 0
 
-        barcodes = ag_data.getBarcodesByKit(kit_id)
+        barcodes = portal_data['barcodes']
 
         kit_ver_error = False
         verification_textbox = ''
-        unconsented = ag_data.get_nonconsented_scanned_barcodes(kit_id)
+        unconsented = portal_data['unconsented']
 
         self.render("portal.html", skid=kit_id, user_name=user_name,
                     errmsg=errmsg, kit_verified=kit_verified,
@@ -44,13 +45,14 @@ class PortalHandler(BaseHandler):
         kit_id = self.current_user
         errmsg = self.get_argument('errmsg', "")
         user_code = self.get_argument('user_verification_code', "")
-        kit_details = ag_data.getAGKitDetails(kit_id)
-        barcodes = ag_data.getBarcodesByKit(kit_id)
-        user_info = ag_data.get_user_info(kit_id)
+        portal_data = ag_data.get_portal_data(kit_id)
+        kit_details = portal_data['kit_details']
+        barcodes = portal_data['barcodes']
+        user_info = portal_data['user_info']
         user_name = user_info['name']
-        results = ag_data.get_barcode_results(kit_id)
+        results = portal_data['results']
         has_results = len(results) != 0
-        unconsented = ag_data.get_nonconsented_scanned_barcodes(kit_id)
+        unconsented = portal_data['unconsented']
 
         kit_verified = True if kit_details['kit_verified'] == 'y' else False
 
@@ -119,7 +119,7 @@ class SampleOverviewHandler(BaseHandler):
     def post(self):
         bc_to_remove = self.get_argument("remove", None)
         if bc_to_remove:
-            ag_login_id = ag_data.get_user_for_kit(self.current_user)
+            ag_login_id = self.ag_login_id
             ag_data.deleteSample(bc_to_remove, ag_login_id)
             self.redirect(media_locale['SITEBASE'] + "/authed/portal/")
             return
@@ -9,7 +9,7 @@ from amgut.handlers.base_handlers import BaseHandler
 from amgut.lib.survey_supp import (
     fermented_survey, surf_survey, personal_microbiome_survey)
 from amgut.lib.util import make_survey_class, store_survey
-from amgut.connections import ag_data, redis
+from amgut.connections import redis
 from amgut import text_locale, media_locale
 
 
@@ -38,9 +38,8 @@ class SecondarySurveyHandler(BaseHandler):
 
     @authenticated
     def post(self):
-        skid = self.current_user
         tl = text_locale['handlers']
-        ag_login_id = ag_data.get_user_for_kit(skid)
+        ag_login_id = self.ag_login_id
         survey_id = self.get_argument('survey_id', None)
         survey_type = self.get_argument('type')
         participant_name = self.get_argument('participant_name')
@@ -52,6 +52,9 @@ class ConfigurationManager(object):
         Path to the base directory where the log file will be written
     cookie_secret : str
         The secret used to secure user session cookies
+    password_workers : int
+        The number of threads hashing and verifying passwords for the web
+        portal
     locale : str
         The locale
     user : str
@@ -64,6 +67,23 @@ class ConfigurationManager(object):
         The host where the database lives
     port : int
         The port used to connect to the postgres database in the previous host
+    pool_min_size : int
+        The number of idle postgres connections always kept open
+    pool_max_size : int
+        The maximum number of postgres connections open at the same time. At
+        least 2, as one of them is kept for the IOLoop thread
+    pool_idle_timeout : float
+        Seconds after which an idle postgres connection is closed
+    pool_max_lifetime : float
+        Seconds after which a postgres connection is closed instead of reused
+    pool_checkout_timeout : float
+        Seconds to wait for a postgres connection when the pool is exhausted
+    slow_query_ms : float
+        Milliseconds after which an SQL statement is logged as slow. Negative
+        to disable the slow query log
+    query_stats_interval : float
+        Seconds between the dumps of the query statistics to the log of the
+        web server. Zero or negative to disable them
     goodpassword : str
         The correct password for the test account
     badpassword : str
@@ -90,6 +110,8 @@ class ConfigurationManager(object):
     IOError
         If the AG_CONFIG environment variable is set, but does not point to an
         existing file
+    ValueError
+        If the locale is not available or `pool_max_size` is smaller than 2
 
     Notes
     -----
@@ -109,6 +131,14 @@ class ConfigurationManager(object):
             'open_humans_client_id': '',
             'open_humans_client_secret': '',
             'open_humans_base_url': 'https://openhumans.org',
+            'pool_min_size': '1',
+            'pool_max_size': '10',
+            'pool_idle_timeout': '300',
+            'pool_max_lifetime': '3600',
+            'pool_checkout_timeout': '30',
+            'slow_query_ms': '500',
+            'query_stats_interval': '3600',
+            'password_workers': '2',
         })
 
         self.defaults = set(config.defaults())
@@ -149,12 +179,14 @@ class ConfigurationManager(object):
         """Get the configuration of the main section"""
         expected_options = {'name', 'shorthand', 'test_environment',
                             'base_data_dir', 'locale', 'base_url',
-                            'cookie_secret', 'error_email', 'sitebase'}
+                            'cookie_secret', 'error_email', 'sitebase',
+                            'password_workers'}
         _warn_on_extra(set(config.options('main')) - expected_options -
                        self.defaults, 'main section option(s)')
 
         get = partial(config.get, 'main')
         getboolean = partial(config.getboolean, 'main')
+        getint = partial(config.getint, 'main')
 
         self.project_name = get('NAME')
         self.project_shorthand = get('SHORTHAND')
@@ -166,6 +198,7 @@ class ConfigurationManager(object):
         self.locale = get('LOCALE')
         self.error_email = get('ERROR_EMAIL')
         self.sitebase = get('SITEBASE')
+        self.password_workers = getint('PASSWORD_WORKERS')
 
         if not exists(self.base_data_dir):
             raise IOError("Directory %s does not exist!" % self.base_data_dir)
@@ -176,12 +209,17 @@ class ConfigurationManager(object):
 
     def _get_postgres(self, config):
         """Get the configuration of the postgres section"""
-        expected_options = {'user', 'password', 'database', 'host', 'port'}
+        expected_options = {'user', 'password', 'database', 'host', 'port',
+                            'pool_min_size', 'pool_max_size',
+                            'pool_idle_timeout', 'pool_max_lifetime',
+                            'pool_checkout_timeout', 'slow_query_ms',
+                            'query_stats_interval'}
         _warn_on_extra(set(config.options('postgres')) - expected_options -
                        self.defaults, 'postgres section option(s)')
 
         get = partial(config.get, 'postgres')
         getint = partial(config.getint, 'postgres')
+        getfloat = partial(config.getfloat, 'postgres')
 
         self.user = get('USER')
         try:
@@ -194,6 +232,17 @@ class ConfigurationManager(object):
         self.database = get('DATABASE')
         self.host = get('HOST')
         self.port = getint('PORT')
+        self.pool_min_size = getint('POOL_MIN_SIZE')
+        self.pool_max_size = getint('POOL_MAX_SIZE')
+        self.pool_idle_timeout = getfloat('POOL_IDLE_TIMEOUT')
+        self.pool_max_lifetime = getfloat('POOL_MAX_LIFETIME')
+        self.pool_checkout_timeout = getfloat('POOL_CHECKOUT_TIMEOUT')
+        self.slow_query_ms = getfloat('SLOW_QUERY_MS')
+        self.query_stats_interval = getfloat('QUERY_STATS_INTERVAL')
+
+        if self.pool_max_size < 2:
+            raise ValueError("POOL_MAX_SIZE must be at least 2, as one "
+                             "connection is kept for the IOLoop thread")
 
     def _get_test(self, config):
         """Get the configuration of the test section"""
@@ -13,12 +13,16 @@ Centralized database access for the American Gut web portal
 """
 
 import logging
+from functools import wraps
 from uuid import UUID
 
-import psycopg2
-from passlib.hash import bcrypt
+from tornado import gen
 
-from amgut.lib.data_access.sql_connection import TRN
+from amgut.lib.data_access.cache import TTLCache
+from amgut.lib.data_access.sql_connection import (
+    TRN, run_async, ITER_FETCH_SIZE)
+from amgut.lib.passwords import (hash_password, verify_password,
+                                 hash_password_async, verify_password_async)
 
 
 # character sets for kit id, passwords and verification codes
@@ -28,6 +32,14 @@ KIT_VERCODE = KIT_PASSWD
 KIT_PASSWD_NOZEROS = KIT_PASSWD[0:-1]
 KIT_VERCODE_NOZEROS = KIT_PASSWD_NOZEROS
 
+# Number of kits whose login id is cached, and for how many seconds
+LOGIN_ID_CACHE_SIZE = 10000
+LOGIN_ID_CACHE_TTL = 3600
+
+# Seconds the reference data shown on the public pages (the countries and the
+# map markers) is cached for
+REFERENCE_CACHE_TTL = 300
+
 
 class AGDataAccess(object):
     """Data Access implementation for all the American Gut web portal
@@ -67,6 +79,13 @@ class AGDataAccess(object):
                      'Sole of shoe',
                      'Water']
 
+    def __init__(self):
+        # A kit never changes its login, so the login id of each kit is only
+        # looked up once
+        self._login_ids = TTLCache(LOGIN_ID_CACHE_SIZE, LOGIN_ID_CACHE_TTL)
+        # Reference data is read on every public page but rarely changes
+        self._reference_data = TTLCache(8, REFERENCE_CACHE_TTL)
+
     #####################################
     # Users
     #####################################
@@ -78,6 +97,34 @@ class AGDataAccess(object):
         web_app_user table. If successful, a dict with user innformation is
         returned. If not, the function returns False.
         """
+        results = self._get_login(username)
+        if results is None or not verify_password(password,
+                                                  results['kit_password']):
+            return False
+        # The user will need their login id on every page
+        self._login_ids.set(username, results['ag_login_id'])
+
+        return results
+
+    def _get_login(self, username):
+        """Returns the user information and password hash of a kit
+
+        Parameters
+        ----------
+        username : str
+            The supplied kit id
+
+        Returns
+        -------
+        dict or None
+            The user information, with the password hash under
+            'kit_password', or None if the kit does not exist
+
+        Notes
+        -----
+        The password is checked by the callers once the connection is back in
+        the pool, as bcrypt is slow by design.
+        """
         with TRN:
             sql = """SELECT  cast(ag_login_id as varchar(100)) as ag_login_id,
                       email, name, address, city,
@@ -85,19 +132,89 @@ class AGDataAccess(object):
                     FROM ag_login
                 INNER JOIN ag_kit USING (ag_login_id)
                 WHERE supplied_kit_id = %s"""
-            TRN.add(sql, [username])
+            TRN.add(sql, [username], prepare='authenticate_web_app_user')
             row = TRN.execute_fetchindex()
             if not row:
-                return False
+                return None
 
             results = dict(row[0])
-
-            if not bcrypt.verify(password, results['kit_password']):
-                return False
             results['ag_login_id'] = str(results['ag_login_id'])
-
             return results
 
+    def check_login(self, username, password):
+        """Checks the password of a registered or a handout kit
+
+        Parameters
+        ----------
+        username : str
+            The supplied kit id
+        password : str
+            The password of the kit
+
+        Returns
+        -------
+        str or None
+            'kit' if `username` is a registered kit, 'handout' if it is a
+            handout kit still to be registered, or None if the kit does not
+            exist or the password is wrong
+        dict or None
+            The user information of a registered kit, as returned by
+            authenticateWebAppUser
+
+        Notes
+        -----
+        A single query looks for the kit in both the registered and the
+        handout kits, so only one password hash is checked.
+        """
+        credentials = self._get_credentials(username)
+        if credentials is None or not verify_password(
+                password, credentials['kit_password']):
+            return None, None
+        return self._logged_in(username, credentials)
+
+    def _get_credentials(self, username):
+        """Returns the password hash of a registered or a handout kit
+
+        Parameters
+        ----------
+        username : str
+            The supplied kit id
+
+        Returns
+        -------
+        dict or None
+            The password hash under 'kit_password', the type of kit under
+            'kit_type' and, for registered kits, the user information. None if
+            the kit does not exist
+        """
+        with TRN:
+            # Registered kits sort first, although a kit is never both
+            sql = """SELECT 'kit' AS kit_type, kit_password,
+                            cast(ag_login_id as varchar(100)) as ag_login_id,
+                            email, name, address, city, state, zip, country
+                     FROM ag_login
+                     JOIN ag_kit USING (ag_login_id)
+                     WHERE supplied_kit_id = %s
+                     UNION ALL
+                     SELECT 'handout', password, NULL, NULL, NULL, NULL,
+                            NULL, NULL, NULL, NULL
+                     FROM ag.ag_handout_kits
+                     WHERE kit_id = %s
+                     ORDER BY kit_type DESC
+                     LIMIT 1"""
+            TRN.add(sql, [username, username], prepare='get_credentials')
+            row = TRN.execute_fetchindex()
+            return dict(row[0]) if row else None
+
+    def _logged_in(self, username, credentials):
+        """Returns the result of a valid check_login"""
+        kit_type = credentials.pop('kit_type')
+        if kit_type != 'kit':
+            return kit_type, None
+        # The user will need their login id on every page
+        self._login_ids.set(username, credentials['ag_login_id'])
+        return kit_type, credentials
+
     def check_login_exists(self, email):
         """Checks if email for login already exists on system
 
@@ -157,6 +274,9 @@ class AGDataAccess(object):
                 TRN.add(sql, [clean_email, name, address, city, state, zip_,
                               country])
                 ag_login_id = TRN.execute_fetchlast()
+                # The new login is shown on the map once it is committed
+                TRN.add_post_commit_func(self._reference_data.invalidate,
+                                         'map_markers')
             return ag_login_id
 
     def getAGBarcodeDetails(self, barcode):
@@ -207,7 +327,7 @@ class AGDataAccess(object):
                  WHERE supplied_kit_id = %s"""
 
         with TRN:
-            TRN.add(sql, [supplied_kit_id])
+            TRN.add(sql, [supplied_kit_id], prepare='get_ag_kit_details')
             row = TRN.execute_fetchindex()
             if not row:
                 raise ValueError('Supplied kit id does not exist in AG: %s' %
@@ -228,66 +348,102 @@ class AGDataAccess(object):
         -------
         bool
             True:  success
-            False: insert failed due to IntegrityError
+            False: the kit or login does not exist, or the insert failed
+            (e.g. the kit is already registered)
 
         Raises
         ------
         ValueError
             Non-UUID4 value sent as ag_login_id
         """
-        with TRN:
+        # make sure properly formatted UUID passed in
+        UUID(ag_login_id, version=4)
+        try:
+            registered = self.register_handout_kits(
+                [(ag_login_id, supplied_kit_id)])
+        except ValueError:
+            # The transaction raises database errors as ValueError
+            logging.exception('Error on skid %s:' % ag_login_id)
+            return False
+        return supplied_kit_id in registered
+
+    def register_handout_kits(self, registrations):
+        """Registers many handout kits at once
+
+        Parameters
+        ----------
+        registrations : iterable of (str, str)
+            The UUID4 formatted login ID and the handout kit ID of each kit to
+            register
+
+        Returns
+        -------
+        list of str
+            The IDs of the kits registered. Kits that are not handout kits or
+            whose login does not exist are not registered
+
+        Raises
+        ------
+        ValueError
+            Non-UUID4 value sent as a login ID, or the same kit is sent more
+            than once
+
+        Notes
+        -----
+        The handout kits are moved to their logins in a single statement,
+        copying the barcodes of all the kits at once
+        """
+        login_ids = []
+        kit_ids = []
+        for ag_login_id, supplied_kit_id in registrations:
             # make sure properly formatted UUID passed in
             UUID(ag_login_id, version=4)
-
-            printresults = self.checkPrintResults(supplied_kit_id)
-            # make sure login_id and skid exists
-            sql = """SELECT EXISTS(SELECT *
-                                   FROM ag.ag_login
-                                   WHERE ag_login_id = %s)"""
-            TRN.add(sql, [ag_login_id])
-            exists = TRN.execute_fetchlast()
-            if not exists:
-                return False
-            sql = """SELECT EXISTS(SELECT *
-                                   FROM ag.ag_handout_kits
-                                   WHERE kit_id = %s)"""
-            TRN.add(sql, [supplied_kit_id])
-            if not TRN.execute_fetchlast():
-                return False
-
-            sql = """
-                DO $do$
-                DECLARE
-                    k_id uuid;
-                    bc varchar;
-                BEGIN
-                    INSERT INTO ag_kit
-                    (ag_login_id, supplied_kit_id, kit_password, swabs_per_kit,
-                     kit_verification_code, print_results)
-                    SELECT '{0}', kit_id, password, swabs_per_kit,
-                        verification_code, '{1}'
-                        FROM ag_handout_kits WHERE kit_id = %s LIMIT 1
-                    RETURNING ag_kit_id INTO k_id;
-                    FOR bc IN
-                        SELECT barcode
-                        FROM ag_handout_barcodes
-                        WHERE kit_id = %s
-                    LOOP
-                        INSERT  INTO ag_kit_barcodes
-                            (ag_kit_id, barcode, sample_barcode_file)
-                            VALUES (k_id, bc, bc || '.jpg');
-                    END LOOP;
-                    DELETE FROM ag_handout_barcodes WHERE kit_id = %s;
-                    DELETE FROM ag_handout_kits WHERE kit_id = %s;
-                END $do$;
-                """.format(ag_login_id, printresults)
-            TRN.add(sql, [supplied_kit_id] * 4)
-            try:
-                TRN.execute()
-            except psycopg2.IntegrityError:
-                logging.exception('Error on skid %s:' % ag_login_id)
-                return False
-            return True
+            if supplied_kit_id in kit_ids:
+                raise ValueError('Kit %s registered more than once' %
+                                 supplied_kit_id)
+            login_ids.append(ag_login_id)
+            kit_ids.append(supplied_kit_id)
+
+        if not kit_ids:
+            return []
+
+        # The handout kits are locked in a consistent order, so concurrent
+        # registrations wait for each other instead of failing or deadlocking.
+        # Removing the handout kits cascades to their barcodes
+        sql = """WITH registrations AS (
+                    SELECT unnest(%s::uuid[]) AS ag_login_id,
+                           unnest(%s::varchar[]) AS kit_id
+                 ), handout AS (
+                    SELECT ag_login_id, kit_id, password, swabs_per_kit,
+                           verification_code, print_results
+                    FROM registrations
+                    JOIN ag.ag_login USING (ag_login_id)
+                    JOIN ag.ag_handout_kits hk USING (kit_id)
+                    ORDER BY kit_id
+                    FOR UPDATE OF hk
+                 ), kits AS (
+                    INSERT INTO ag.ag_kit
+                        (ag_login_id, supplied_kit_id, kit_password,
+                         swabs_per_kit, kit_verification_code, print_results)
+                    SELECT ag_login_id, kit_id, password, swabs_per_kit,
+                           verification_code, print_results
+                    FROM handout
+                    RETURNING ag_kit_id, supplied_kit_id
+                 ), barcodes AS (
+                    INSERT INTO ag.ag_kit_barcodes
+                        (ag_kit_id, barcode, sample_barcode_file)
+                    SELECT ag_kit_id, barcode, barcode || '.jpg'
+                    FROM kits
+                    JOIN ag.ag_handout_barcodes hb
+                        ON hb.kit_id = kits.supplied_kit_id
+                 ), handout_removed AS (
+                    DELETE FROM ag.ag_handout_kits
+                    WHERE kit_id IN (SELECT supplied_kit_id FROM kits)
+                 )
+                 SELECT supplied_kit_id FROM kits"""
+        with TRN:
+            TRN.add(sql, [login_ids, kit_ids])
+            return TRN.execute_fetchflatten()
 
     def get_all_handout_kits(self):
         with TRN:
@@ -295,6 +451,25 @@ class AGDataAccess(object):
             TRN.add(sql)
             return TRN.execute_fetchflatten()
 
+    def iter_all_handout_kits(self, fetch_size=ITER_FETCH_SIZE):
+        """Yields the IDs of all the handout kits, reading them lazily
+
+        Parameters
+        ----------
+        fetch_size : int, optional
+            The number of kits read from the database at a time
+
+        Returns
+        -------
+        generator of str
+            The IDs of the handout kits
+        """
+        with TRN:
+            sql = 'SELECT kit_id FROM ag.ag_handout_kits'
+            for kit_id, in TRN.execute_iter(sql, fetch_size=fetch_size,
+                                            row_type='tuple'):
+                yield kit_id
+
     def deleteAGParticipantSurvey(self, ag_login_id, participant_name):
         # Remove user from new schema
         with TRN:
@@ -343,9 +518,29 @@ class AGDataAccess(object):
         """
         with TRN:
             sql = "SELECT * FROM consent_revoked"
-            TRN.add(sql)
+            TRN.add(sql, row_type='tuple')
             return TRN.execute_fetchindex()
 
+    def iter_withdrawn(self, fetch_size=ITER_FETCH_SIZE):
+        """Yields the withdrawn participants, reading them lazily
+
+        Parameters
+        ----------
+        fetch_size : int, optional
+            The number of participants read from the database at a time
+
+        Returns
+        -------
+        generator of tuple of strings
+            The withdrawn participants, in the form
+            (ag_login_id, participant_name, participant_email, date_revoked)
+        """
+        with TRN:
+            sql = "SELECT * FROM consent_revoked"
+            for row in TRN.execute_iter(sql, fetch_size=fetch_size,
+                                        row_type='tuple'):
+                yield row
+
     def getConsent(self, survey_id):
         with TRN:
             TRN.add("""SELECT agc.participant_name,
@@ -560,22 +755,42 @@ class AGDataAccess(object):
             return TRN.execute_fetchflatten()
 
     def getMapMarkers(self):
-        with TRN:
-            sql = """SELECT country, count(country)::integer
-            FROM ag.ag_login GROUP BY country"""
-            TRN.add(sql)
-            return dict(TRN.execute_fetchindex())
+        """Returns the number of logins of each country
+
+        Returns
+        -------
+        dict of {str: int}
+            The number of logins keyed by country
+
+        Notes
+        -----
+        The counts are read from ag.login_country_counts, kept up to date by
+        triggers on ag.ag_login. They are cached for `REFERENCE_CACHE_TTL`
+        seconds, and until a new login is added by this process.
+        """
+        markers = self._reference_data.get('map_markers')
+        if markers is None:
+            with TRN:
+                sql = """SELECT country, num_logins
+                         FROM ag.login_country_counts
+                         WHERE num_logins > 0"""
+                TRN.add(sql, row_type='tuple')
+                markers = dict(TRN.execute_fetchindex())
+            self._reference_data.set('map_markers', markers)
+        # Callers get their own copy, so they cannot change the cached one
+        return dict(markers)
 
     def handoutCheck(self, username, password):
+        hashed = self._get_handout_password(username)
+        return hashed is not None and verify_password(password, hashed)
+
+    def _get_handout_password(self, username):
+        """Returns the password hash of a handout kit, or None if missing"""
         with TRN:
             sql = "SELECT password FROM ag.ag_handout_kits WHERE kit_id = %s"
-            TRN.add(sql, [username])
+            TRN.add(sql, [username], row_type='tuple')
             to_check = TRN.execute_fetchindex()
-
-            if not to_check:
-                return False
-            else:
-                return bcrypt.verify(password, to_check[0][0])
+            return to_check[0][0] if to_check else None
 
     def check_access(self, supplied_kit_id, barcode):
         """Check if the user has access to the barcode
@@ -599,9 +814,42 @@ class AGDataAccess(object):
                         FROM ag.ag_kit
                         JOIN ag.ag_kit_barcodes USING (ag_kit_id)
                       WHERE ag_login_id = %s AND barcode = %s)"""
-            TRN.add(sql, [ag_login_id, barcode])
+            TRN.add(sql, [ag_login_id, barcode], prepare='check_access')
             return TRN.execute_fetchlast()
 
+    def check_access_many(self, supplied_kit_id, barcodes):
+        """Check if the user has access to each of the barcodes
+
+        Parameters
+        ----------
+        supplied_kit_id : str
+            The user's supplied kit ID
+        barcodes : iterable of str
+            The barcodes to check access for
+
+        Returns
+        -------
+        dict of {str: bool}
+            Whether the user can access each barcode
+
+        See Also
+        --------
+        check_access
+        """
+        barcodes = list(barcodes)
+        if not barcodes:
+            return {}
+
+        with TRN:
+            ag_login_id = self.get_user_for_kit(supplied_kit_id)
+            sql = """SELECT barcode
+                     FROM ag.ag_kit
+                     JOIN ag.ag_kit_barcodes USING (ag_kit_id)
+                     WHERE ag_login_id = %s AND barcode = ANY(%s)"""
+            TRN.add(sql, [ag_login_id, barcodes])
+            accessible = set(TRN.execute_fetchflatten())
+        return {barcode: barcode in accessible for barcode in barcodes}
+
     def getAGKitIDsByEmail(self, email):
         """Returns a list of kitids based on email
 
@@ -637,12 +885,15 @@ class AGDataAccess(object):
         kit_id is supplied_kit_id in the ag_kit table
         password is the new password
         """
+        self._set_kit_password(kit_id, hash_password(password))
+
+    def _set_kit_password(self, kit_id, hashed):
+        """Stores the bcrypt hash of the new password of a kit"""
         with TRN:
-            password = bcrypt.encrypt(password)
             sql = """UPDATE AG_KIT
                      SET kit_password = %s, pass_reset_code = NULL
                      WHERE supplied_kit_id = %s"""
-            TRN.add(sql, [password, kit_id])
+            TRN.add(sql, [hashed, kit_id])
 
     def ag_verify_kit_password_change_code(self, email, kitid, passcode):
         """returns true if it still in the password change window
@@ -724,36 +975,137 @@ class AGDataAccess(object):
             return False if not results else results[0][0]
 
     def get_user_for_kit(self, supplied_kit_id):
+        """Returns the login id of a kit
+
+        Parameters
+        ----------
+        supplied_kit_id : str
+            The user's supplied kit ID
+
+        Returns
+        -------
+        str
+            The ag_login_id that owns the kit
+
+        Raises
+        ------
+        ValueError
+            If the kit does not exist
+
+        Notes
+        -----
+        Login ids are cached in memory for `LOGIN_ID_CACHE_TTL` seconds
+        """
+        ag_login_id = self._login_ids.get(supplied_kit_id)
+        if ag_login_id is not None:
+            return ag_login_id
+
         with TRN:
             sql = """SELECT ag_login_id
                      FROM ag.ag_kit
                      JOIN ag_login USING (ag_login_id)
                      WHERE supplied_kit_id = %s"""
-            TRN.add(sql, [supplied_kit_id])
+            TRN.add(sql, [supplied_kit_id], prepare='get_user_for_kit')
             results = TRN.execute_fetchindex()
             if results:
-                return results[0][0]
+                ag_login_id = results[0][0]
+                self._login_ids.set(supplied_kit_id, ag_login_id)
+                return ag_login_id
             else:
                 raise ValueError("No user ID for kit %s" % supplied_kit_id)
 
     def get_menu_items(self, supplied_kit_id):
-        """Returns information required to populate the menu of the website"""
-        with TRN:
-            ag_login_id = self.get_user_for_kit(supplied_kit_id)
-            info = self.getAGKitDetails(supplied_kit_id)
+        """Returns information required to populate the menu of the website
 
-            kit_verified = False
-            if info['kit_verified'] == 'y':
-                kit_verified = True
+        Parameters
+        ----------
+        supplied_kit_id : str
+            The user's supplied kit ID
 
-            human_samples = {hs: self.getParticipantSamples(ag_login_id, hs)
-                             for hs in self.getHumanParticipants(ag_login_id)}
-            animal_samples = {a: self.getParticipantSamples(ag_login_id, a)
-                              for a in self.getAnimalParticipants(ag_login_id)}
-            environmental_samples = self.getEnvironmentalSamples(ag_login_id)
+        Returns
+        -------
+        tuple of (dict, dict, list of dict, bool)
+            The samples of each human participant, the samples of each animal
+            participant, the environmental samples and whether the kit has
+            been verified. Samples are dicts with the same keys as the ones
+            returned by `getParticipantSamples`
 
-            return (human_samples, animal_samples, environmental_samples,
-                    kit_verified)
+        Raises
+        ------
+        ValueError
+            If the kit does not exist
+        """
+        sample_columns = ('barcode', 'site_sampled', 'sample_date',
+                          'sample_time', 'notes', 'status')
+        with TRN:
+            sql = """SELECT ag_login_id, kit_verified
+                     FROM ag.ag_kit
+                     JOIN ag_login USING (ag_login_id)
+                     WHERE supplied_kit_id = %s"""
+            TRN.add(sql, [supplied_kit_id])
+            rows = TRN.execute_fetchindex()
+            if not rows:
+                raise ValueError("No user ID for kit %s" % supplied_kit_id)
+            ag_login_id, kit_verified = rows[0]
+
+            # The participants (survey 1 is human and survey 2 is animal)
+            # with their samples, followed by the environmental samples
+            # (kind 0)
+            sql = """WITH participants AS (
+                        SELECT DISTINCT participant_name, ags.survey_id AS kind
+                        FROM ag.ag_login_surveys
+                        JOIN ag.survey_answers USING (survey_id)
+                        JOIN ag.group_questions gq USING (survey_question_id)
+                        JOIN ag.surveys ags USING (survey_group)
+                        WHERE ag_login_id = %s AND ags.survey_id IN (1, 2)
+                     ), samples AS (
+                        SELECT participant_name, barcode, site_sampled,
+                            sample_date, sample_time, notes, status
+                        FROM ag_kit_barcodes akb
+                        INNER JOIN barcode USING (barcode)
+                        INNER JOIN ag_kit ak USING (ag_kit_id)
+                        INNER JOIN ag_login_surveys
+                            USING (survey_id, ag_login_id)
+                        WHERE (site_sampled IS NOT NULL
+                               AND site_sampled::text <> '')
+                            AND ag_login_id = %s
+                     )
+                     SELECT kind, participant_name, barcode, site_sampled,
+                        sample_date, sample_time, notes, status
+                     FROM participants
+                     LEFT JOIN samples USING (participant_name)
+                     UNION ALL
+                     SELECT 0, NULL, barcode, site_sampled, sample_date,
+                        sample_time, notes, status
+                     FROM ag_kit_barcodes
+                     INNER JOIN barcode USING (barcode)
+                     INNER JOIN ag_kit USING(ag_kit_id)
+                     WHERE (environment_sampled IS NOT NULL AND
+                        environment_sampled::text <> '')
+                        AND ag_login_id = %s"""
+            TRN.add(sql, [ag_login_id] * 3)
+            rows = TRN.execute_fetchindex()
+
+        human_samples = {}
+        animal_samples = {}
+        environmental_samples = []
+        for row in rows:
+            sample = {c: row[c] for c in sample_columns}
+            if row['kind'] == 0:
+                environmental_samples.append(sample)
+                continue
+
+            if row['kind'] == 1:
+                participants = human_samples
+            else:
+                participants = animal_samples
+            samples = participants.setdefault(row['participant_name'], [])
+            # Participants without samples only have the participant row
+            if row['barcode'] is not None:
+                samples.append(sample)
+
+        return (human_samples, animal_samples, environmental_samples,
+                kit_verified == 'y')
 
     def check_if_consent_exists(self, ag_login_id, participant_name):
         """Return True if a consent already exists"""
@@ -772,7 +1124,7 @@ class AGDataAccess(object):
                      FROM ag_login
                      INNER JOIN ag_kit USING(ag_login_id)
                      WHERE supplied_kit_id = %s"""
-            TRN.add(sql, [supplied_kit_id])
+            TRN.add(sql, [supplied_kit_id], prepare='get_user_info')
             row = TRN.execute_fetchindex()
             if not row:
                 raise ValueError('Supplied kit id is not in DB: %s' %
@@ -806,6 +1158,86 @@ class AGDataAccess(object):
             TRN.add(sql, [ag_login_id])
             return [dict(row) for row in TRN.execute_fetchindex()]
 
+    def get_portal_data(self, supplied_kit_id):
+        """Gets everything shown in the portal page of a kit
+
+        Parameters
+        ----------
+        supplied_kit_id : str
+            The user's supplied kit ID
+
+        Returns
+        -------
+        dict
+            The portal data, with the keys:
+            'user_info': the dict returned by `get_user_info`
+            'kit_details': the dict returned by `getAGKitDetails`
+            'results': the list returned by `get_barcode_results`
+            'barcodes': the list returned by `getBarcodesByKit`
+            'unconsented': the list returned by
+            `get_nonconsented_scanned_barcodes`
+
+        Raises
+        ------
+        ValueError
+            If the kit does not exist
+
+        Notes
+        -----
+        All the data is retrieved in a single query
+        """
+        user_columns = ('ag_login_id', 'email', 'name', 'address', 'city',
+                        'state', 'zip', 'country')
+        kit_columns = ('ag_kit_id', 'supplied_kit_id', 'kit_password',
+                       'swabs_per_kit', 'kit_verified',
+                       'kit_verification_code', 'verification_email_sent')
+        sql = """SELECT CAST(ag_login_id AS VARCHAR(100)) AS ag_login_id,
+                        email, name, address, city, state, zip, country,
+                        CAST(ag_kit_id AS VARCHAR(100)) AS ag_kit_id,
+                        supplied_kit_id, kit_password, swabs_per_kit,
+                        kit_verified, kit_verification_code,
+                        verification_email_sent,
+                        r.result_barcodes, r.result_participants,
+                        ARRAY(SELECT barcode
+                              FROM ag_kit_barcodes akb
+                              WHERE akb.ag_kit_id = ak.ag_kit_id) AS barcodes,
+                        ARRAY(SELECT barcode
+                              FROM ag_kit_barcodes
+                              INNER JOIN ag_kit USING (ag_kit_id)
+                              LEFT JOIN barcode USING (barcode)
+                              WHERE survey_id IS NULL
+                                AND scan_date IS NOT NULL
+                                AND ag_login_id = al.ag_login_id
+                              ) AS unconsented
+                 FROM ag_kit ak
+                 INNER JOIN ag_login al USING (ag_login_id)
+                 LEFT JOIN LATERAL (
+                    SELECT array_agg(barcode) AS result_barcodes,
+                           array_agg(participant_name) AS result_participants
+                    FROM ag_kit_barcodes
+                    INNER JOIN ag_kit USING (ag_kit_id)
+                    INNER JOIN ag_login_surveys USING (survey_id, ag_login_id)
+                    WHERE ag_login_id = al.ag_login_id
+                        AND results_ready = 'Y') r ON true
+                 WHERE supplied_kit_id = %s"""
+        with TRN:
+            TRN.add(sql, [supplied_kit_id])
+            rows = TRN.execute_fetchindex()
+            if not rows:
+                raise ValueError('Supplied kit id is not in DB: %s' %
+                                 supplied_kit_id)
+            row = rows[0]
+
+        results = zip(row['result_barcodes'] or [],
+                      row['result_participants'] or [])
+        return {
+            'user_info': {c: row[c] for c in user_columns},
+            'kit_details': {c: row[c] for c in kit_columns},
+            'results': [{'barcode': b, 'participant_name': p}
+                        for b, p in results],
+            'barcodes': row['barcodes'],
+            'unconsented': row['unconsented']}
+
     def get_login_info(self, ag_login_id):
         """Get kit registration information
 
@@ -872,11 +1304,20 @@ class AGDataAccess(object):
         Returns
         -------
         list of str
-         All country names in database"""
-        with TRN:
-            sql = 'SELECT country FROM ag.iso_country_lookup ORDER BY country'
-            TRN.add(sql)
-            return TRN.execute_fetchflatten()
+         All country names in database
+
+        Notes
+        -----
+        The countries are cached for `REFERENCE_CACHE_TTL` seconds"""
+        countries = self._reference_data.get('countries')
+        if countries is None:
+            with TRN:
+                sql = ('SELECT country FROM ag.iso_country_lookup '
+                       'ORDER BY country')
+                TRN.add(sql)
+                countries = TRN.execute_fetchflatten()
+            self._reference_data.set('countries', countries)
+        return list(countries)
 
     def is_deposited_ebi(self, barcode):
         """Check if barcode is deposited to EBI
@@ -907,3 +1348,127 @@ class AGDataAccess(object):
             sql = "SELECT deposited FROM ag.ag_kit_barcodes WHERE barcode = %s"
             TRN.add(sql, [barcode])
             return TRN.execute_fetchlast()
+
+    def deposited_ebi_many(self, barcodes):
+        """Check if each of the barcodes is deposited to EBI
+
+        Parameters
+        ----------
+        barcodes : iterable of str
+            Barcodes to check
+
+        Returns
+        -------
+        dict of {str: bool}
+            If each barcode has been deposited (True) or has not (False)
+
+        Raises
+        ------
+        ValueError
+            Any of the barcodes is not a registered AG barcode
+
+        See Also
+        --------
+        is_deposited_ebi
+        """
+        barcodes = list(barcodes)
+        if not barcodes:
+            return {}
+
+        with TRN:
+            sql = """SELECT barcode, deposited
+                     FROM ag.ag_kit_barcodes
+                     WHERE barcode = ANY(%s)"""
+            TRN.add(sql, [barcodes], row_type='tuple')
+            deposited = dict(TRN.execute_fetchindex())
+
+        missing = set(barcodes) - set(deposited)
+        if missing:
+            raise ValueError('Barcodes %s not registered AG barcodes' %
+                             ', '.join(sorted(missing)))
+        return deposited
+
+
+class AsyncAGDataAccess(object):
+    """Non-blocking access to the American Gut web portal data
+
+    Every method of AGDataAccess is available with the same signature, but it
+    runs in its own transaction on a worker thread and returns a Future that
+    resolves to the method result, so it can be yielded from coroutines
+    without blocking the IOLoop. The methods that check or change passwords
+    only use a worker thread for their queries, and run bcrypt in the password
+    threads.
+
+    Parameters
+    ----------
+    ag_data_access : AGDataAccess, optional
+        The object whose methods are wrapped. A new one is created if not
+        provided
+    """
+    def __init__(self, ag_data_access=None):
+        if ag_data_access is None:
+            ag_data_access = AGDataAccess()
+        self._ag_data_access = ag_data_access
+
+    def __getattr__(self, name):
+        attr = getattr(self._ag_data_access, name)
+        if not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def wrapper(*args, **kwargs):
+            return run_async(attr, *args, **kwargs)
+
+        return wrapper
+
+    @gen.coroutine
+    def authenticateWebAppUser(self, username, password):
+        """Asynchronous version of AGDataAccess.authenticateWebAppUser
+
+        The password is checked in the password threads, so neither the
+        IOLoop nor a database thread waits on bcrypt
+        """
+        ag_data = self._ag_data_access
+        results = yield run_async(ag_data._get_login, username)
+        if results is None:
+            raise gen.Return(False)
+
+        valid = yield verify_password_async(password, results['kit_password'])
+        if not valid:
+            raise gen.Return(False)
+        # The user will need their login id on every page
+        ag_data._login_ids.set(username, results['ag_login_id'])
+
+        raise gen.Return(results)
+
+    @gen.coroutine
+    def check_login(self, username, password):
+        """Asynchronous version of AGDataAccess.check_login"""
+        ag_data = self._ag_data_access
+        credentials = yield run_async(ag_data._get_credentials, username)
+        if credentials is None:
+            raise gen.Return((None, None))
+
+        valid = yield verify_password_async(password,
+                                            credentials['kit_password'])
+        if not valid:
+            raise gen.Return((None, None))
+        raise gen.Return(ag_data._logged_in(username, credentials))
+
+    @gen.coroutine
+    def handoutCheck(self, username, password):
+        """Asynchronous version of AGDataAccess.handoutCheck"""
+        hashed = yield run_async(self._ag_data_access._get_handout_password,
+                                 username)
+        if hashed is None:
+            raise gen.Return(False)
+
+        valid = yield verify_password_async(password, hashed)
+        raise gen.Return(valid)
+
+    @gen.coroutine
+    def ag_update_kit_password(self, kit_id, password):
+        """Asynchronous version of AGDataAccess.ag_update_kit_password"""
+        hashed = yield hash_password_async(password)
+        yield run_async(self._ag_data_access._set_kit_password, kit_id,
+                        hashed)
@@ -0,0 +1,97 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The American Gut Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+"""
+In-process caches for data that rarely changes
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+
+class TTLCache(object):
+    """A thread-safe least recently used cache whose entries expire
+
+    Parameters
+    ----------
+    max_size : int
+        The maximum number of entries. When full, the least recently used
+        entry is evicted
+    ttl : float
+        Seconds after which an entry expires
+
+    Raises
+    ------
+    ValueError
+        If `max_size` is smaller than 1
+    """
+    def __init__(self, max_size, ttl):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Returns the value of `key`, or `default` if missing or expired
+
+        Parameters
+        ----------
+        key : hashable
+            The key to look up
+        default : object, optional
+            The value returned if the key is not cached
+
+        Returns
+        -------
+        object
+            The cached value
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= time():
+                return default
+            # Re-inserting the entry marks it as the most recently used
+            self._entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value):
+        """Caches `value` under `key`
+
+        Parameters
+        ----------
+        key : hashable
+            The key to cache the value under
+        value : object
+            The value to cache
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time() + self.ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Removes `key` from the cache, or every entry if `key` is None
+
+        Parameters
+        ----------
+        key : hashable, optional
+            The key to remove
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
@@ -1,8 +1,12 @@
 from os.path import abspath, dirname, join, split
 from glob import glob
 from functools import partial
+from itertools import islice
+from multiprocessing import Pool
 from subprocess import Popen, PIPE
+import csv
 import gzip
+import re
 
 from click import echo
 from psycopg2 import (connect, OperationalError)
@@ -11,6 +15,7 @@ from natsort import natsorted
 
 from amgut.lib.config_manager import AMGUT_CONFIG
 from amgut.lib.data_access.sql_connection import TRN
+from amgut.lib.passwords import hash_password
 
 
 get_db_file = partial(join, join(dirname(dirname(abspath(__file__))), '..',
@@ -20,6 +25,14 @@ INITIALIZE_FP = get_db_file('initialize.sql')
 POPULATE_FP = get_db_file('ag_test_patch22.sql.gz')
 PATCHES_DIR = get_db_file('patches')
 
+# Columns of the files of handout kits, the barcodes of a kit are separated by
+# spaces, commas or semicolons
+HANDOUT_COLUMNS = ('kit_id', 'password', 'verification_code', 'barcodes')
+_BARCODES_SEP_RE = re.compile(r'[\s,;]+')
+
+# Number of handout kits hashed and loaded at a time
+HANDOUT_CHUNK_SIZE = 500
+
 
 def _check_db_exists(db, cursor):
     r"""Check if the database db exists on the postgres server
@@ -211,3 +224,141 @@ def rebuild_test(verbose=False):
     if verbose:
         print "Patching database"
     patch_db(verbose=verbose)
+
+
+def _read_handout_kits(kits_fp):
+    """Yields the kits of a CSV or TSV file of handout kits
+
+    Parameters
+    ----------
+    kits_fp : str
+        The path to the file
+
+    Returns
+    -------
+    generator of (str, str, str, list of str)
+        The kit id, password, verification code and barcodes of each kit
+
+    Raises
+    ------
+    ValueError
+        If the file is missing any of `HANDOUT_COLUMNS` or a kit has an empty
+        value
+    """
+    with open(kits_fp, 'rb') as f:
+        try:
+            dialect = csv.Sniffer().sniff(f.readline(), delimiters=',\t')
+        except csv.Error:
+            raise ValueError("%s is not a CSV or TSV file" % kits_fp)
+        f.seek(0)
+
+        reader = csv.DictReader(f, dialect=dialect)
+        missing = set(HANDOUT_COLUMNS).difference(reader.fieldnames)
+        if missing:
+            raise ValueError("%s is missing the columns: %s"
+                             % (kits_fp, ', '.join(sorted(missing))))
+
+        for line, row in enumerate(reader, 2):
+            kit = [(row[c] or '').strip() for c in HANDOUT_COLUMNS]
+            if not all(kit):
+                raise ValueError("Empty values in line %d of %s"
+                                 % (line, kits_fp))
+            kit[-1] = _BARCODES_SEP_RE.split(kit[-1])
+            yield tuple(kit)
+
+
+def import_handout_kits(kits_fp, chunk_size=HANDOUT_CHUNK_SIZE,
+                        processes=None, callback=None):
+    """Loads pre-printed handout kits and their barcodes into the database
+
+    Parameters
+    ----------
+    kits_fp : str
+        The path to a CSV or TSV file with a header and the columns kit_id,
+        password, verification_code and barcodes. The barcodes of a kit are
+        separated by spaces, commas or semicolons
+    chunk_size : int, optional
+        The number of kits hashed and loaded at a time
+    processes : int, optional
+        The number of processes hashing the passwords. Defaults to the number
+        of CPUs
+    callback : callable, optional
+        Called with the number of kits of each chunk once it is loaded, e.g.
+        to report progress
+
+    Returns
+    -------
+    int
+        The number of kits loaded
+
+    Raises
+    ------
+    ValueError
+        If the file is not valid, or a kit or barcode cannot be loaded
+
+    Notes
+    -----
+    The file is streamed and each chunk is loaded with COPY, so memory use
+    does not grow with the number of kits. All the kits are loaded in a single
+    transaction: if any of them fails, none of them is loaded. The barcodes
+    must already exist in barcodes.barcode.
+    """
+    kits = _read_handout_kits(kits_fp)
+    pool = Pool(processes)
+    loaded = 0
+    try:
+        with TRN:
+            while True:
+                chunk = list(islice(kits, chunk_size))
+                if not chunk:
+                    break
+                # bcrypt is slow by design, so the passwords are hashed in
+                # parallel
+                passwords = pool.map(hash_password, [k[1] for k in chunk])
+
+                TRN.copy_from(
+                    'ag.ag_handout_kits',
+                    ['kit_id', 'password', 'verification_code',
+                     'swabs_per_kit'],
+                    [(kit_id, password, code, len(barcodes))
+                     for (kit_id, _, code, barcodes), password
+                     in zip(chunk, passwords)])
+                TRN.copy_from(
+                    'ag.ag_handout_barcodes', ['kit_id', 'barcode'],
+                    [(kit[0], barcode) for kit in chunk for barcode in kit[3]])
+
+                loaded += len(chunk)
+                if callback is not None:
+                    callback(len(chunk))
+    finally:
+        pool.close()
+        pool.join()
+
+    return loaded
+
+
+def rebuild_country_counts(verbose=False):
+    """Recomputes the number of logins of each country from ag.ag_login
+
+    The counts are kept up to date by triggers, so this is only needed if
+    they were changed by hand or ag.ag_login was bulk loaded with the
+    triggers disabled.
+
+    Parameters
+    ----------
+    verbose : bool, optional
+        Show messages while working, default False
+    """
+    with TRN:
+        # Logins cannot be added until the counts are rebuilt
+        TRN.add("LOCK TABLE ag.ag_login IN SHARE MODE")
+        TRN.add("DELETE FROM ag.login_country_counts")
+        TRN.add("""INSERT INTO ag.login_country_counts (country, num_logins)
+                   SELECT country, count(*) FROM ag.ag_login
+                   WHERE country IS NOT NULL
+                   GROUP BY country""")
+        TRN.add("SELECT count(*) FROM ag.login_country_counts")
+        num_countries = TRN.execute_fetchlast()
+
+    if verbose:
+        echo("Rebuilt the login counts of %d countries" % num_countries)
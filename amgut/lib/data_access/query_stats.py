@@ -0,0 +1,153 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The American Gut Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+"""
+Timing statistics of the SQL statements run by the web portal
+"""
+
+from __future__ import division
+from bisect import bisect_left
+from threading import Lock
+import logging
+import re
+
+
+# Upper bounds, in milliseconds, of the buckets of the timing histograms. The
+# last bucket holds everything slower than the last bound
+HISTOGRAM_BOUNDS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_LITERAL_RE = re.compile(
+    r"'(?:[^']|'')*'|%\([^)]*\)s|%s|\$\d+|\b\d+(?:\.\d+)?\b")
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Normalises an sql query so the same query always looks the same
+
+    Parameters
+    ----------
+    sql : str
+        The sql query
+
+    Returns
+    -------
+    str
+        The query with its whitespace collapsed and its literals and
+        placeholders replaced by ``?``
+    """
+    return _WHITESPACE_RE.sub(' ', _LITERAL_RE.sub('?', sql)).strip()
+
+
+class QueryStats(object):
+    """Collects the timing of the SQL statements run in this process
+
+    Parameters
+    ----------
+    slow_query_ms : float
+        Statements that take at least this number of milliseconds are logged
+        as warnings. A negative value disables the slow query log
+
+    Notes
+    -----
+    Statistics are kept in memory, aggregated by the fingerprint of the
+    query, and are shared by all the threads of the process.
+    """
+    def __init__(self, slow_query_ms):
+        self.slow_query_ms = slow_query_ms
+        self._lock = Lock()
+        self._stats = {}
+
+    def record(self, sql, seconds, rows, caller):
+        """Records an executed statement
+
+        Parameters
+        ----------
+        sql : str
+            The sql query
+        seconds : float
+            The wall time it took to run the statement
+        rows : int
+            The number of rows returned or affected by the statement
+        caller : str
+            The function that ran the statement
+        """
+        ms = seconds * 1000
+        key = fingerprint(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = {
+                    'query': key, 'count': 0, 'total_ms': 0, 'max_ms': 0,
+                    'rows': 0, 'callers': set(),
+                    'histogram': [0] * (len(HISTOGRAM_BOUNDS) + 1)}
+            stats['count'] += 1
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+            stats['rows'] += max(rows, 0)
+            stats['callers'].add(caller)
+            stats['histogram'][bisect_left(HISTOGRAM_BOUNDS, ms)] += 1
+
+        if 0 <= self.slow_query_ms <= ms:
+            logging.warning('Slow query: %.1f ms, %d rows, called from %s\n%s'
+                            % (ms, rows, caller, sql))
+
+    def summary(self, reset=False):
+        """Returns the statistics of each query, slowest in total first
+
+        Parameters
+        ----------
+        reset : bool, optional
+            Whether to discard the returned statistics. Defaults to False
+
+        Returns
+        -------
+        list of dict
+            The statistics of each query fingerprint, with the keys 'query',
+            'count', 'total_ms', 'max_ms', 'rows', 'callers' and 'histogram'.
+            The histogram holds the number of executions that fell in each
+            bucket of `HISTOGRAM_BOUNDS`
+        """
+        with self._lock:
+            summary = [dict(stats, callers=sorted(stats['callers']),
+                            histogram=list(stats['histogram']))
+                       for stats in self._stats.values()]
+            if reset:
+                self._stats = {}
+        return sorted(summary, key=lambda s: s['total_ms'], reverse=True)
+
+    def log_summary(self, limit=20):
+        """Logs the statistics of the queries that took the most time in total
+
+        Parameters
+        ----------
+        limit : int, optional
+            The maximum number of queries logged. Defaults to 20
+
+        Notes
+        -----
+        The statistics are reset, so each call logs the queries run since the
+        previous one.
+        """
+        summary = self.summary(reset=True)
+        if not summary:
+            return
+
+        lines = ['Query statistics: %d queries, %d statements, %.1f ms'
+                 % (len(summary), sum(s['count'] for s in summary),
+                    sum(s['total_ms'] for s in summary))]
+        for stats in summary[:limit]:
+            lines.append('%8d calls %10.1f ms total %8.1f ms max %8d rows  %s'
+                         % (stats['count'], stats['total_ms'],
+                            stats['max_ms'], stats['rows'], stats['query']))
+            lines.append('    called from %s' % ', '.join(stats['callers']))
+        logging.warning('\n'.join(lines))
+
+    def reset(self):
+        """Discards all the collected statistics"""
+        with self._lock:
+            self._stats = {}
@@ -7,15 +7,153 @@
 # -----------------------------------------------------------------------------
 from __future__ import division
 from contextlib import contextmanager
-from itertools import chain
+from itertools import chain, count
 from functools import wraps
+from StringIO import StringIO
+from threading import Condition, local
+import re
+import sys
+from time import time
 
+from concurrent.futures import ThreadPoolExecutor
 from psycopg2 import (connect, ProgrammingError, Error as PostgresError,
                       OperationalError)
-from psycopg2.extras import DictCursor
-from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import DictCursor, NamedTupleCursor
+from psycopg2.extensions import (connection, TRANSACTION_STATUS_IDLE,
+                                 TRANSACTION_STATUS_UNKNOWN)
 
 from amgut.lib.config_manager import AMGUT_CONFIG
+from amgut.lib.data_access.query_stats import QueryStats
+
+
+# Connections that have been idle in the pool for longer than this number of
+# seconds are pinged before being handed out again
+_PING_AFTER = 30
+
+# Schemas searched for unqualified table names. It is sent as a connection
+# option, which makes it the session default: RESET and DISCARD go back to it
+# and no query has to set it again
+SEARCH_PATH = 'ag,barcodes,public'
+
+
+# Cursor used to fetch the rows of a query, for each available row type
+ROW_TYPES = {'dict': DictCursor,
+             'tuple': None,
+             'namedtuple': NamedTupleCursor}
+
+# Number of rows fetched at a time by the server-side cursors of execute_iter
+ITER_FETCH_SIZE = 2000
+
+# Used to give a unique name to each server-side cursor
+_CURSOR_IDS = count()
+
+# Maximum number of statements sent to the server in a single round trip
+_PIPELINE_MAX = 100
+
+# Statements that never return rows, so their results do not need to be
+# fetched one at a time
+_NO_ROWS_RE = re.compile(r'^\s*(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+_RETURNING_RE = re.compile(r'\bRETURNING\b', re.IGNORECASE)
+
+# Single-row INSERT ... VALUES (...) queries. Consecutive ones with the same
+# sql (e.g. added with many=True) are sent as a single multi-row INSERT, using
+# the VALUES tuple as the template for every row
+_VALUES_RE = re.compile(
+    r'^\s*INSERT\s+INTO\s.+?\sVALUES\s*'
+    r'(\((?:[^()]|\([^()]*\))*\))\s*;?\s*$', re.IGNORECASE | re.DOTALL)
+
+# Characters that have to be escaped in the text format of COPY
+_COPY_ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+_COPY_ESCAPE_RE = re.compile(r'[\\\t\n\r]')
+
+
+def _returns_no_rows(sql):
+    """Whether `sql` is a single statement that does not return any row
+
+    Parameters
+    ----------
+    sql : str or PreparedStatement
+        The queued query
+
+    Returns
+    -------
+    bool
+        True if the query can be sent in the middle of a pipeline
+    """
+    if isinstance(sql, PreparedStatement):
+        return False
+    # Queries with several statements may end in one that returns rows
+    return (_NO_ROWS_RE.match(sql) is not None and
+            _RETURNING_RE.search(sql) is None and
+            ';' not in sql.strip().rstrip(';'))
+
+
+def _continues_insert(prev_sql, sql):
+    """Whether `sql` can be merged into the multi-row INSERT of `prev_sql`
+
+    Parameters
+    ----------
+    prev_sql : str or PreparedStatement
+        The previous query in the queue
+    sql : str or PreparedStatement
+        The queued query
+
+    Returns
+    -------
+    bool
+        True if both are the same single-row INSERT ... VALUES (...) query
+    """
+    return (sql == prev_sql and not isinstance(sql, PreparedStatement) and
+            _VALUES_RE.match(sql) is not None)
+
+
+class _Query(tuple):
+    """A query queued in a transaction, as a (sql, sql_args) tuple
+
+    Parameters
+    ----------
+    sql : str or PreparedStatement
+        The sql query
+    sql_args : list, tuple or dict of objects
+        The arguments to the sql query
+    row_type : {'dict', 'tuple', 'namedtuple'}
+        How the rows returned by the query are built
+    """
+    def __new__(cls, sql, sql_args, row_type):
+        query = super(_Query, cls).__new__(cls, (sql, sql_args))
+        query.row_type = row_type
+        return query
+
+
+def _copy_value(value):
+    """Formats a value for the text format of COPY"""
+    if value is None:
+        return '\\N'
+    return _COPY_ESCAPE_RE.sub(lambda m: _COPY_ESCAPES[m.group()],
+                               '%s' % value)
+
+
+def _caller():
+    """Returns the name of the function that is running the current query
+
+    Returns
+    -------
+    str
+        The first function in the call stack outside of this module, as
+        ``Class.method`` for methods and ``module.function`` otherwise
+    """
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_globals.get('__name__') == __name__:
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+
+    code = frame.f_code
+    if code.co_argcount and code.co_varnames[0] == 'self':
+        owner = type(frame.f_locals['self']).__name__
+    else:
+        owner = frame.f_globals.get('__name__')
+    return '%s.%s' % (owner, code.co_name)
 
 
 def _checker(func):
@@ -30,41 +168,147 @@ def _checker(func):
     return wrapper
 
 
-class Transaction(object):
-    """A context manager that encapsulates a DB transaction
+class PreparedStatement(object):
+    """An SQL statement that is prepared once per connection
 
-    A transaction is defined by a series of consecutive queries that need to
-    be applied to the database as a single block.
+    Parameters
+    ----------
+    name : str
+        The name of the statement on the server
+    sql : str
+        The sql query, with positional ``%s`` placeholders
 
     Raises
     ------
-    RuntimeError
-        If the transaction methods are invoked outside a context.
+    ValueError
+        If `name` is not a valid identifier or `sql` uses named placeholders
 
     Notes
     -----
-    When the execution leaves the context manager, any remaining queries in
-    the transaction will be executed and committed.
+    Prepared statements are registered with `Transaction.add` through its
+    `prepare` parameter rather than instantiated directly.
     """
-    def __init__(self):
-        self._queries = []
-        self._results = []
-        self._contexts_entered = 0
-        self._connection = None
-        self._post_commit_funcs = []
-        self._post_rollback_funcs = []
+    _name_re = re.compile(r'^[a-z_][a-z0-9_]*$')
+    _placeholder_re = re.compile(r'%(%|s)')
 
-    def _open_connection(self):
-        # If the connection already exists and is not closed, don't do anything
-        if self._connection is not None and self._connection.closed == 0:
-            return
+    def __init__(self, name, sql):
+        if not self._name_re.match(name):
+            raise ValueError("Invalid prepared statement name: %s" % name)
+        if '%(' in sql:
+            raise ValueError("Prepared statements only support positional "
+                             "placeholders: %s" % sql)
+        self.name = name
+        self.sql = sql
+
+        n_args = [0]
+
+        def to_positional(match):
+            if match.group(1) == '%':
+                return '%'
+            n_args[0] += 1
+            return '$%d' % n_args[0]
+
+        self.prepare_sql = 'PREPARE %s AS %s' % (
+            name, self._placeholder_re.sub(to_positional, sql))
+        if n_args[0]:
+            self.execute_sql = 'EXECUTE %s (%s)' % (
+                name, ', '.join(['%s'] * n_args[0]))
+        else:
+            self.execute_sql = 'EXECUTE %s' % name
+
+    def __str__(self):
+        return self.sql
+
+
+# Registry of the prepared statements, keyed by name
+_PREPARED_STATEMENTS = {}
+
+
+def _get_prepared_statement(name, sql):
+    """Returns the registered statement `name`, registering it if needed
 
+    Raises
+    ------
+    ValueError
+        If a different query has already been registered as `name`
+    """
+    stmt = _PREPARED_STATEMENTS.get(name)
+    if stmt is None:
+        stmt = _PREPARED_STATEMENTS.setdefault(name,
+                                               PreparedStatement(name, sql))
+    if stmt.sql != sql:
+        raise ValueError("A different query is already prepared as %s" %
+                         name)
+    return stmt
+
+
+class _PooledConnection(connection):
+    """A psycopg2 connection that keeps track of its age and last use"""
+    def __init__(self, *args, **kwargs):
+        super(_PooledConnection, self).__init__(*args, **kwargs)
+        self.created = self.last_used = time()
+        # Names of the statements prepared on this connection
+        self.prepared = set()
+
+
+class ConnectionPool(object):
+    """A bounded pool of postgres connections
+
+    Parameters
+    ----------
+    min_size : int
+        The number of idle connections kept open regardless of their idle
+        time
+    max_size : int
+        The maximum number of connections open at the same time
+    idle_timeout : float
+        Seconds after which an idle connection is closed, as long as at least
+        `min_size` idle connections are left in the pool
+    max_lifetime : float
+        Seconds after which a connection is closed instead of being reused
+    checkout_timeout : float
+        Seconds to wait for a free connection when `max_size` connections are
+        already in use
+
+    Raises
+    ------
+    ValueError
+        If the size limits are not consistent
+
+    Notes
+    -----
+    Connections are opened lazily, the first time they are requested. On
+    checkout, connections that have been closed, are in an unknown state or
+    are past their lifetime are discarded, and connections that have been idle
+    for a while are pinged before being handed out.
+    """
+    def __init__(self, min_size, max_size, idle_timeout, max_lifetime,
+                 checkout_timeout):
+        if max_size < 1 or not 0 <= min_size <= max_size:
+            raise ValueError("Invalid pool size limits: min_size %d, "
+                             "max_size %d" % (min_size, max_size))
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+
+        # Idle connections, the most recently used one last
+        self._idle = []
+        # Number of connections handed out, including the slots reserved for
+        # connections that are being opened
+        self._in_use = 0
+        self._cond = Condition()
+
+    def _connect(self):
         try:
-            self._connection = connect(user=AMGUT_CONFIG.user,
-                                       password=AMGUT_CONFIG.password,
-                                       database=AMGUT_CONFIG.database,
-                                       host=AMGUT_CONFIG.host,
-                                       port=AMGUT_CONFIG.port)
+            return connect(user=AMGUT_CONFIG.user,
+                           password=AMGUT_CONFIG.password,
+                           database=AMGUT_CONFIG.database,
+                           host=AMGUT_CONFIG.host,
+                           port=AMGUT_CONFIG.port,
+                           options='-c search_path=%s' % SEARCH_PATH,
+                           connection_factory=_PooledConnection)
         except OperationalError as e:
             # catch three known common exceptions and raise runtime errors
             try:
@@ -93,14 +337,199 @@ class Transaction(object):
                      ' in the Qiita installation base directory.')
             raise RuntimeError(ebase % (e.message, etext))
 
-    def close(self):
+    def _expired(self, conn, now):
+        return now - conn.created > self.max_lifetime
+
+    def _prune(self, now):
+        """Closes the expired idle connections. Must hold the lock"""
+        keep = []
+        # Oldest connections first, so the most recently used ones are the
+        # ones kept to honor min_size
+        for i, conn in enumerate(self._idle):
+            n_left = len(self._idle) - i
+            idle_expired = (now - conn.last_used > self.idle_timeout and
+                            n_left + len(keep) > self.min_size)
+            if idle_expired or self._expired(conn, now):
+                conn.close()
+            else:
+                keep.append(conn)
+        self._idle = keep
+
+    def _checkout(self):
+        """Takes an idle connection from the pool or reserves a new slot
+
+        Returns
+        -------
+        _PooledConnection or None
+            An idle connection, or None if a slot for a new connection has
+            been reserved
+
+        Raises
+        ------
+        RuntimeError
+            If no connection is available after `checkout_timeout` seconds
+        """
+        deadline = time() + self.checkout_timeout
+        with self._cond:
+            while True:
+                now = time()
+                self._prune(now)
+                if self._idle:
+                    self._in_use += 1
+                    return self._idle.pop()
+                if self._in_use < self.max_size:
+                    self._in_use += 1
+                    return None
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise RuntimeError(
+                        "Could not get a postgres connection after %s seconds:"
+                        " all %d connections in the pool are in use"
+                        % (self.checkout_timeout, self.max_size))
+                self._cond.wait(remaining)
+
+    def _is_healthy(self, conn):
+        if (conn.closed != 0 or
+                conn.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN):
+            return False
+        if time() - conn.last_used > _PING_AFTER:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+            except PostgresError:
+                return False
+        return True
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    def getconn(self):
+        """Checks out a connection from the pool
+
+        Returns
+        -------
+        psycopg2.extensions.connection
+            A connection with no transaction in progress
+
+        Raises
+        ------
+        RuntimeError
+            If no connection is available after `checkout_timeout` seconds or
+            a new connection cannot be opened
+        """
+        while True:
+            conn = self._checkout()
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+            if self._is_healthy(conn):
+                return conn
+            conn.close()
+            self._release_slot()
+
+    def putconn(self, conn, close=False):
+        """Returns a connection previously checked out to the pool
+
+        Parameters
+        ----------
+        conn : psycopg2.extensions.connection
+            The connection to return
+        close : bool, optional
+            Whether the connection should be closed instead of being reused
+        """
+        if not close and conn.closed == 0:
+            status = conn.get_transaction_status()
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != TRANSACTION_STATUS_IDLE:
+                # Never hand out a connection in the middle of a transaction
+                try:
+                    conn.rollback()
+                except PostgresError:
+                    close = True
+
+        now = time()
+        with self._cond:
+            self._in_use -= 1
+            if close or conn.closed != 0 or self._expired(conn, now):
+                conn.close()
+            else:
+                conn.last_used = now
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        """Closes all the idle connections in the pool"""
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._idle = []
+
+
+class Transaction(object):
+    """A context manager that encapsulates a DB transaction
+
+    A transaction is defined by a series of consecutive queries that need to
+    be applied to the database as a single block.
+
+    Raises
+    ------
+    RuntimeError
+        If the transaction methods are invoked outside a context.
+
+    Notes
+    -----
+    When the execution leaves the context manager, any remaining queries in
+    the transaction will be executed and committed.
+    The connection used by the transaction is checked out from `POOL` when
+    entering the first context and returned to it when leaving the last one.
+    """
+    def __init__(self):
+        self._queries = []
+        self._results = []
+        self._contexts_entered = 0
+        self._connection = None
+        self._post_commit_funcs = []
+        self._post_rollback_funcs = []
+        # Names of the server-side cursors open in the postgres transaction
+        self._server_cursors = set()
+
+    def _open_connection(self):
+        # If the connection already exists and is not closed, don't do anything
+        if self._connection is not None and self._connection.closed == 0:
+            return
+
         if self._connection is not None:
-            self._connection.close()
+            # The connection has been closed (e.g. a commit failed), give its
+            # slot back to the pool before asking for a new one
+            self._release_connection()
+
+        self._connection = POOL.getconn()
+
+    def _release_connection(self, close=False):
+        """Returns the connection of the transaction to the pool"""
+        if self._connection is not None:
+            POOL.putconn(self._connection, close=close)
+            self._connection = None
+
+    def close(self):
+        self._release_connection(close=True)
 
     @contextmanager
-    def _get_cursor(self):
+    def _get_cursor(self, row_type='dict'):
         """Returns a postgres cursor
 
+        Parameters
+        ----------
+        row_type : {'dict', 'tuple', 'namedtuple'}, optional
+            How the rows fetched from the cursor are built. Defaults to dict
+
         Returns
         -------
         psycopg2.cursor
@@ -114,7 +543,8 @@ class Transaction(object):
         self._open_connection()
 
         try:
-            with self._connection.cursor(cursor_factory=DictCursor) as cur:
+            with self._connection.cursor(
+                    cursor_factory=ROW_TYPES[row_type]) as cur:
                 yield cur
         except PostgresError as e:
             raise RuntimeError("Cannot get postgres cursor: %s" % e)
@@ -151,6 +581,7 @@ class Transaction(object):
                 self._clean_up(exc_type)
             finally:
                 self._contexts_entered -= 1
+                self._release_connection()
         else:
             self._contexts_entered -= 1
 
@@ -170,7 +601,8 @@ class Transaction(object):
             % (sql, str(sql_args), str(error)))
 
     @_checker
-    def add(self, sql, sql_args=None, many=False):
+    def add(self, sql, sql_args=None, many=False, prepare=None,
+            row_type='dict'):
         """Add an sql query to the transaction
 
         Parameters
@@ -182,11 +614,24 @@ class Transaction(object):
         many : bool, optional
             Whether or not we should add the query multiple times to the
             transaction
+        prepare : str, optional
+            If provided, the query is executed as a server-side prepared
+            statement with this name. Useful for queries that are run very
+            often, as postgres only parses and plans them once per connection
+        row_type : {'dict', 'tuple', 'namedtuple'}, optional
+            How the rows returned by the query are built. Defaults to dict, a
+            row that can be indexed by position or by column name. Plain
+            tuples are cheaper to build, so use them when the column names are
+            not needed
 
         Raises
         ------
         TypeError
             If `sql_args` is provided and is not a list, tuple or dict
+        ValueError
+            If `prepare` is not a valid name, is already used for a different
+            query or `sql` uses named placeholders, or if `row_type` is not
+            one of the available row types
         RuntimeError
             If invoked outside a context
 
@@ -196,8 +641,17 @@ class Transaction(object):
         dicts, in which each element of the list contains the parameters for
         one SQL query of the many. Each element on the list is all the
         parameters for a single one of the many queries added. The amount of
-        SQL queries added to the list is len(sql_args).
+        SQL queries added to the list is len(sql_args). When `sql` is a
+        single-row ``INSERT ... VALUES (...)`` without a RETURNING clause, all
+        of them are sent to the server as a single multi-row INSERT.
         """
+        if row_type not in ROW_TYPES:
+            raise ValueError("Unknown row type %s. Available: %s"
+                             % (row_type, ', '.join(sorted(ROW_TYPES))))
+
+        if prepare is not None:
+            sql = _get_prepared_statement(prepare, sql)
+
         if not many:
             sql_args = [sql_args]
 
@@ -206,40 +660,155 @@ class Transaction(object):
                 if not isinstance(args, (list, tuple, dict)):
                     raise TypeError("sql_args should be a list, tuple or dict."
                                     " Found %s" % type(args))
-            self._queries.append((sql, args))
+            self._queries.append(_Query(sql, args, row_type))
+
+    def _execute_prepared(self, cur, stmt, sql_args):
+        """Executes a prepared statement, preparing it first if needed
+
+        Statements are prepared once per connection, so they are prepared
+        again when the transaction gets a new connection from the pool
+        """
+        prepared = self._connection.prepared
+        if stmt.name not in prepared:
+            cur.execute(stmt.prepare_sql)
+            prepared.add(stmt.name)
+        cur.execute(stmt.execute_sql, sql_args)
+
+    def _fetch(self, cur, sql, sql_args):
+        """Fetches the rows produced by the last query executed on `cur`"""
+        try:
+            return cur.fetchall()
+        except ProgrammingError:
+            # At this execution point, we don't know if the sql query
+            # that we executed should retrieve values from the database
+            # If the query was not supposed to retrieve any value
+            # (e.g. an INSERT without a RETURNING clause), it will
+            # raise a ProgrammingError. Otherwise it will just return
+            # an empty list
+            return None
+        except PostgresError as e:
+            # Some other error happened during the execution of the
+            # query, so we need to rollback
+            self._raise_execution_error(sql, sql_args, e)
+
+    def _pipeline_end(self, start):
+        """Finds the queries that can be sent together with `start`
+
+        Parameters
+        ----------
+        start : int
+            The index in the queue of the first query of the pipeline
+
+        Returns
+        -------
+        int
+            The index in the queue right after the last query of the pipeline
+        """
+        queries = self._queries
+        end = start
+        statements = 0
+        while end < len(queries) and _returns_no_rows(queries[end][0]):
+            # Rows of a multi-row INSERT do not count as separate statements
+            if (end == start or
+                    not _continues_insert(queries[end - 1][0],
+                                          queries[end][0])):
+                if statements == _PIPELINE_MAX - 1:
+                    break
+                statements += 1
+            end += 1
+        # The rows of the last query of the pipeline are still fetched, so it
+        # can be any query that is not a prepared statement
+        if end < len(queries) and (
+                end == start or
+                not isinstance(queries[end][0], PreparedStatement)):
+            end += 1
+        return end
+
+    def _execute_pipeline(self, cur, queries):
+        """Sends several queries to the server in a single round trip
+
+        Parameters
+        ----------
+        cur : psycopg2.cursor
+            The cursor used to execute the queries
+        queries : list of (str, list)
+            The queries to execute and their arguments. Only the last one is
+            allowed to return rows
+
+        Notes
+        -----
+        Runs of the same single-row INSERT query are merged in a single
+        multi-row INSERT statement. The time of each statement is not known,
+        so the round trip is recorded once in `QUERY_STATS`, under the
+        fingerprint of its joined statements. Its row count is the one of the
+        last statement, the only one postgres reports.
+        """
+        # Used to report errors, the rows of a multi-row INSERT are only
+        # shown once
+        sql = ';\n'.join(
+            q for i, (q, _) in enumerate(queries)
+            if i == 0 or not _continues_insert(queries[i - 1][0], q))
+        sql_args = [a for _, a in queries]
+        start = time()
+        try:
+            statements = []
+            prev_sql = None
+            for q, a in queries:
+                if _continues_insert(prev_sql, q):
+                    template = _VALUES_RE.match(q).group(1)
+                    statements[-1] += ', ' + cur.mogrify(template, a)
+                else:
+                    statements.append(
+                        cur.mogrify(q.rstrip().rstrip(';'), a))
+                prev_sql = q
+            cur.execute(';\n'.join(statements))
+        except Exception as e:
+            self._raise_execution_error(sql, sql_args, e)
+
+        res = self._fetch(cur, sql, sql_args)
+        QUERY_STATS.record(sql, time() - start, cur.rowcount, _caller())
+        self._results.extend([None] * (len(queries) - 1))
+        self._results.append(res)
 
     def _execute(self):
         """Internal function that actually executes the transaction
         The `execute` function exposed in the API wraps this one to make sure
         that we catch any exception that happens in here and we rollback the
         transaction
+
+        Notes
+        -----
+        Consecutive queries that do not return rows are sent to the server in
+        a single round trip, together with the query that follows them. Runs
+        of the same single-row INSERT are merged in a multi-row INSERT.
         """
-        with self._get_cursor() as cur:
-            cur.execute('SET search_path TO ag, barcodes, public')
-            for sql, sql_args in self._queries:
+        idx = 0
+        while idx < len(self._queries):
+            end = self._pipeline_end(idx)
+            # Only the last query sent to the server can return rows
+            with self._get_cursor(self._queries[end - 1].row_type) as cur:
+                if end - idx > 1:
+                    self._execute_pipeline(cur, self._queries[idx:end])
+                    idx = end
+                    continue
+
+                sql, sql_args = self._queries[idx]
+                idx += 1
+                start = time()
                 # Execute the current SQL command
                 try:
-                    cur.execute(sql, sql_args)
+                    if isinstance(sql, PreparedStatement):
+                        self._execute_prepared(cur, sql, sql_args)
+                    else:
+                        cur.execute(sql, sql_args)
                 except Exception as e:
                     # We catch any exception as we want to make sure that we
                     # rollback every time that something went wrong
                     self._raise_execution_error(sql, sql_args, e)
 
-                try:
-                    res = cur.fetchall()
-                except ProgrammingError as e:
-                    # At this execution point, we don't know if the sql query
-                    # that we executed should retrieve values from the database
-                    # If the query was not supposed to retrieve any value
-                    # (e.g. an INSERT without a RETURNING clause), it will
-                    # raise a ProgrammingError. Otherwise it will just return
-                    # an empty list
-                    res = None
-                except PostgresError as e:
-                    # Some other error happened during the execution of the
-                    # query, so we need to rollback
-                    self._raise_execution_error(sql, sql_args, e)
-
+                res = self._fetch(cur, sql, sql_args)
+                QUERY_STATS.record(str(sql), time() - start, cur.rowcount,
+                                   _caller())
                 # Store the results of the current query
                 self._results.append(res)
 
@@ -281,6 +850,170 @@ class Transaction(object):
             self.rollback()
             raise
 
+    @_checker
+    def execute_iter(self, sql, sql_args=None, fetch_size=ITER_FETCH_SIZE,
+                     row_type='dict'):
+        """Executes the transaction and then streams the rows of `sql`
+
+        Parameters
+        ----------
+        sql : str
+            The sql query
+        sql_args : list, tuple or dict of objects, optional
+            The arguments to the sql query
+        fetch_size : int, optional
+            The number of rows fetched from the server at a time
+        row_type : {'dict', 'tuple', 'namedtuple'}, optional
+            How the rows returned by the query are built. Defaults to dict
+
+        Returns
+        -------
+        generator
+            The rows of the query, fetched lazily
+
+        Raises
+        ------
+        ValueError
+            If `row_type` is not one of the available row types, or if there
+            is an error running the query
+        RuntimeError
+            If invoked outside a context, or if the rows are consumed after
+            the transaction is committed or rolled back
+
+        Notes
+        -----
+        The query is run on a server-side cursor, so only `fetch_size` rows
+        are held in memory at any time and the rows are not stored in the
+        results of the transaction. The cursor only lives as long as the
+        postgres transaction, so the rows must be consumed before the
+        transaction is committed or rolled back. The query is recorded in
+        `QUERY_STATS` once the cursor is closed, with the time spent running
+        it and fetching its rows.
+
+        See Also
+        --------
+        execute
+        """
+        if row_type not in ROW_TYPES:
+            raise ValueError("Unknown row type %s. Available: %s"
+                             % (row_type, ', '.join(sorted(ROW_TYPES))))
+
+        # Queries queued before this one should see their results first
+        self.execute()
+        self._open_connection()
+
+        cur = self._connection.cursor('amgut_iter_%d' % next(_CURSOR_IDS),
+                                      cursor_factory=ROW_TYPES[row_type])
+        self._server_cursors.add(cur.name)
+        start = time()
+        try:
+            cur.execute(sql, sql_args)
+        except Exception as e:
+            self._raise_execution_error(sql, sql_args, e)
+        return self._iter_cursor(cur, fetch_size, sql, sql_args,
+                                 time() - start)
+
+    def _iter_cursor(self, cur, fetch_size, sql, sql_args, seconds):
+        """Yields the rows of a server-side cursor, `fetch_size` at a time
+
+        `seconds` is the time it took to run the query. The time spent
+        fetching the rows is added to it, but not the time spent by the
+        caller between fetches
+        """
+        num_rows = 0
+        failed = False
+        try:
+            while True:
+                # Once the transaction has ended, its connection may be in use
+                # by another transaction, which a FETCH would abort
+                if cur.name not in self._server_cursors:
+                    failed = True
+                    raise RuntimeError(
+                        "The rows of execute_iter must be consumed before the "
+                        "transaction is committed or rolled back")
+                start = time()
+                try:
+                    rows = cur.fetchmany(fetch_size)
+                except PostgresError as e:
+                    failed = True
+                    self._raise_execution_error(sql, sql_args, e)
+                seconds += time() - start
+                if not rows:
+                    break
+                num_rows += len(rows)
+                for row in rows:
+                    yield row
+        finally:
+            # The cursor is already gone if the transaction has ended, and
+            # closing it again would abort any new transaction
+            if cur.name in self._server_cursors:
+                self._server_cursors.discard(cur.name)
+                cur.close()
+            if not failed:
+                QUERY_STATS.record(sql, seconds, num_rows, _caller())
+
+    @_checker
+    def copy_from(self, table, columns, rows):
+        """Executes the transaction and then loads `rows` into `table`
+
+        Parameters
+        ----------
+        table : str
+            The name of the table, e.g. 'ag.ag_handout_kits'
+        columns : list of str
+            The columns of the table the values of each row are loaded into
+        rows : iterable of tuples
+            The rows to load. Each one has a value for each of `columns`
+
+        Returns
+        -------
+        int
+            The number of rows loaded
+
+        Raises
+        ------
+        ValueError
+            If there is an error loading the rows
+        RuntimeError
+            If invoked outside a context
+
+        Notes
+        -----
+        The rows are loaded with a single COPY statement, which is much
+        faster than inserting them one at a time. Like any other query, the
+        rows are only committed when leaving the context.
+        """
+        # Queries queued before this one should see their results first
+        self.execute()
+
+        data = StringIO(''.join(
+            '\t'.join(_copy_value(v) for v in row) + '\n' for row in rows))
+        sql = "COPY %s (%s) FROM STDIN" % (table, ', '.join(columns))
+        with self._get_cursor('tuple') as cur:
+            start = time()
+            try:
+                cur.copy_expert(sql, data)
+            except Exception as e:
+                self._raise_execution_error(sql, None, e)
+            QUERY_STATS.record(sql, time() - start, cur.rowcount, _caller())
+            return cur.rowcount
+
+    def _use_tuples(self, idx):
+        """Fetches the rows of the `idx` query as tuples if it is not executed
+
+        Parameters
+        ----------
+        idx : int
+            The index of the query, as used to index the results of `execute`
+        """
+        num_results = len(self._results)
+        if idx < 0:
+            idx += num_results + len(self._queries)
+        idx -= num_results
+        if 0 <= idx < len(self._queries):
+            sql, sql_args = self._queries[idx]
+            self._queries[idx] = _Query(sql, sql_args, 'tuple')
+
     @_checker
     def execute_fetchlast(self):
         """Executes the transaction and returns the last result
@@ -299,6 +1032,8 @@ class Transaction(object):
         execute_fetchindex
         execute_fetchflatten
         """
+        # Only a single value is returned, no need to build a dict row
+        self._use_tuples(-1)
         return self.execute()[-1][0][0]
 
     @_checker
@@ -352,8 +1087,64 @@ class Transaction(object):
         execute_fetchlast
         execute_fetchindex
         """
+        # Only the values are returned, no need to build dict rows
+        self._use_tuples(idx)
         return list(chain.from_iterable(self.execute()[idx]))
 
+    @_checker
+    def execute_async(self):
+        """Executes the transaction without blocking the calling thread
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the value returned by `execute`
+
+        Notes
+        -----
+        The caller must wait for the future to complete before using the
+        transaction again.
+
+        See Also
+        --------
+        execute
+        run_async
+        """
+        return EXECUTOR.submit(self.execute)
+
+    @_checker
+    def execute_fetchlast_async(self):
+        """Asynchronous version of `execute_fetchlast`
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the value returned by `execute_fetchlast`
+        """
+        return EXECUTOR.submit(self.execute_fetchlast)
+
+    @_checker
+    def execute_fetchindex_async(self, idx=-1):
+        """Asynchronous version of `execute_fetchindex`
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the value returned by `execute_fetchindex`
+        """
+        return EXECUTOR.submit(self.execute_fetchindex, idx)
+
+    @_checker
+    def execute_fetchflatten_async(self, idx=-1):
+        """Asynchronous version of `execute_fetchflatten`
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the value returned by `execute_fetchflatten`
+        """
+        return EXECUTOR.submit(self.execute_fetchflatten, idx)
+
     def _funcs_executor(self, funcs, func_str):
         error_msg = []
         for f, args, kwargs in funcs:
@@ -382,6 +1173,8 @@ class Transaction(object):
         # Reset the queries, the results and the index
         self._queries = []
         self._results = []
+        # Server-side cursors do not outlive the postgres transaction
+        self._server_cursors.clear()
         try:
             self._connection.commit()
         except Exception:
@@ -402,6 +1195,8 @@ class Transaction(object):
         # Reset the queries, the results and the index
         self._queries = []
         self._results = []
+        # Server-side cursors do not outlive the postgres transaction
+        self._server_cursors.clear()
         try:
             self._connection.rollback()
         except Exception:
@@ -454,5 +1249,124 @@ class Transaction(object):
         """
         self._post_rollback_funcs.append((func, args, kwargs))
 
-# Singleton pattern, create the transaction for the entire system
-TRN = Transaction()
+
+class _BoundTransactions(local):
+    """Per-thread record of the transactions in use"""
+    def __init__(self):
+        # Transaction used when none has been explicitly bound
+        self.default = None
+        # Transactions bound with bind_transaction, innermost last
+        self.stack = []
+
+
+_bound = _BoundTransactions()
+
+
+def get_transaction():
+    """Returns the transaction bound to the current thread or task
+
+    Returns
+    -------
+    Transaction
+        The innermost transaction bound with `bind_transaction`, or a
+        transaction private to the current thread if none has been bound
+    """
+    if _bound.stack:
+        return _bound.stack[-1]
+    if _bound.default is None:
+        _bound.default = Transaction()
+    return _bound.default
+
+
+@contextmanager
+def bind_transaction(trn=None):
+    """Binds a transaction to the current thread or task
+
+    While the context is active, `TRN` (and `get_transaction`) resolve to the
+    bound transaction.
+
+    Parameters
+    ----------
+    trn : Transaction, optional
+        The transaction to bind. A new one is created if not provided
+
+    Yields
+    ------
+    Transaction
+        The bound transaction
+
+    Notes
+    -----
+    To keep a transaction bound across the callbacks of an asynchronous task,
+    run it inside ``tornado.stack_context.StackContext(partial(
+    bind_transaction, trn))``, which re-binds `trn` every time one of the
+    task callbacks runs.
+    """
+    if trn is None:
+        trn = Transaction()
+    _bound.stack.append(trn)
+    try:
+        yield trn
+    finally:
+        _bound.stack.pop()
+
+
+def run_async(func, *args, **kwargs):
+    """Runs a function that accesses the database without blocking
+
+    Parameters
+    ----------
+    func : callable
+        The function to run. Any use of `TRN` inside it resolves to a new
+        transaction, committed when `func` leaves its outermost context
+    args : tuple
+        The arguments of the function
+    kwargs : dict
+        The keyword arguments of the function
+
+    Returns
+    -------
+    concurrent.futures.Future
+        Resolves to the value returned by `func`. Tornado coroutines can
+        yield it directly
+    """
+    def task():
+        with bind_transaction():
+            return func(*args, **kwargs)
+
+    return EXECUTOR.submit(task)
+
+
+class _TransactionProxy(object):
+    """Forwards everything to the transaction returned by get_transaction"""
+    def __getattr__(self, name):
+        return getattr(get_transaction(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_transaction(), name, value)
+
+    def __enter__(self):
+        return get_transaction().__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return get_transaction().__exit__(exc_type, exc_value, traceback)
+
+
+# Connection pool shared by all the transactions of the process
+POOL = ConnectionPool(AMGUT_CONFIG.pool_min_size, AMGUT_CONFIG.pool_max_size,
+                      AMGUT_CONFIG.pool_idle_timeout,
+                      AMGUT_CONFIG.pool_max_lifetime,
+                      AMGUT_CONFIG.pool_checkout_timeout)
+
+# Timing of the statements run by all the transactions of the process
+QUERY_STATS = QueryStats(AMGUT_CONFIG.slow_query_ms)
+
+# Threads running the database work of asynchronous code. Each of them holds
+# at most one pooled connection at a time. There is one thread less than
+# connections, so the transactions run on the IOLoop thread never wait for the
+# pool, which would freeze the whole web server
+EXECUTOR = ThreadPoolExecutor(max_workers=AMGUT_CONFIG.pool_max_size - 1)
+
+# The transaction of the current request or task. Each thread gets its own
+# transaction, and requests and tasks can isolate theirs with bind_transaction
+TRN = _TransactionProxy()
@@ -10,6 +10,10 @@ from __future__ import division
 # -----------------------------------------------------------------------------
 
 from collections import defaultdict
+from cPickle import dump, load, HIGHEST_PROTOCOL
+from os import rename, getpid
+from os.path import join
+import logging
 
 from wtforms import (SelectField, SelectMultipleField, widgets,
                      TextAreaField, TextField)
@@ -23,106 +27,156 @@ _LOCALE_TO_COLUMN = {'american_gut': 'american',
 
 _LOCALE_COLUMN = _LOCALE_TO_COLUMN[AMGUT_CONFIG.locale]
 
+# Survey definitions only change with database patches, so a snapshot of them
+# is kept on disk for the workers to start without querying them
+SNAPSHOT_FP = join(AMGUT_CONFIG.base_data_dir,
+                   'survey_definitions_%s.pkl' % AMGUT_CONFIG.locale)
+
 
 class Question(object):
+    """A question of a survey
+
+    Parameters
+    ----------
+    ID : int
+        The ID in the database of the question
+    group_name : str
+        The american name of the group the question belongs to
+    definition : dict, optional
+        The definition of the question, as returned by `_fetch_definitions`.
+        It is fetched from the database if not provided
+    """
     _survey_question_table = 'survey_question'
     _question_response_table = 'survey_question_response'
     _response_table = 'survey_response'
     _response_type_table = 'survey_question_response_type'
     _supplemental_survey_table = 'survey_question_triggers'
 
-    def __init__(self, ID, group_name):
-        with TRN:
-            self.id = ID
-            self.group_name = group_name
-            self.set_response = None
-
-            sql = """SELECT sr.{0}
-                     FROM {1} q
-                     JOIN {2} qr
-                         ON q.survey_question_id = qr.survey_question_id
-                     JOIN {3} sr
-                         ON qr.response = sr.{0}
-                     WHERE q.survey_question_id = %s
-                     ORDER BY qr.display_index
-                  """.format(_LOCALE_COLUMN, self._survey_question_table,
-                             self._question_response_table,
-                             self._response_table)
-            TRN.add(sql, [self.id])
-            self.responses = TRN.execute_fetchflatten()
-
-            if not self.responses:
-                self.responses = None
-
-            sql = """SELECT survey_response_type
-                     FROM {0}
-                     WHERE survey_question_id = %s
-                  """.format(self._response_type_table)
-            TRN.add(sql, [self.id])
-            self.response_type = TRN.execute_fetchlast()
+    def __init__(self, ID, group_name, definition=None):
+        if definition is None:
+            definition = self._fetch_definitions([ID])[ID]
 
-            sql = """SELECT {0}
-                     FROM {1}
-                     WHERE survey_question_id = %s
-                  """.format(_LOCALE_COLUMN, self._survey_question_table)
-            TRN.add(sql, [self.id])
-            self.question = TRN.execute_fetchlast()
+        self.id = ID
+        self.group_name = group_name
+        self.set_response = None
 
-            sql = """SELECT american
-                     FROM {0}
-                     WHERE survey_question_id = %s
-                  """.format(self._survey_question_table)
-            TRN.add(sql, [self.id])
-            self.american_question = TRN.execute_fetchlast()
+        self.responses = list(definition['responses']) or None
+        self.response_type = definition['response_type']
+        self.question = definition['question']
+        self.american_question = definition['american_question']
+        self.triggers = self._triggers(definition)
+        self.qid = '_'.join(self.group_name.split() + [str(self.id)])
 
-            self.triggers = self._triggers()
-            self.qid = '_'.join(self.group_name.split() + [str(self.id)])
+        element_ids, elements = self._interface_elements()
+        self.interface_elements = elements
+        self.interface_element_ids = ['%s_%d' % (self.qid, i)
+                                      for i in element_ids]
 
-            element_ids, elements = self._interface_elements()
-            self.interface_elements = elements
-            self.interface_element_ids = ['%s_%d' % (self.qid, i)
-                                          for i in element_ids]
+    @classmethod
+    def _fetch_definitions(cls, question_ids):
+        """Fetches the definitions of several questions at once
 
-    def _triggers(self):
-        """What other question-response combinations this question can trigger
+        Parameters
+        ----------
+        question_ids : list of int
+            The IDs of the questions
 
         Returns
         -------
-        tuple
-            (other_question_id, [triggering indices to that question])
+        dict of {int: dict}
+            The definition of each question, with the keys 'question',
+            'american_question', 'response_type', 'responses' (the localized
+            responses in display order) and 'triggers' (the indices of the
+            responses that trigger each other question)
+
+        Raises
+        ------
+        ValueError
+            If any of the questions does not exist
         """
         with TRN:
-            sql = """SELECT triggered_question, display_index
+            sql = """SELECT survey_question_id, q.{0}, q.american,
+                            survey_response_type
+                     FROM {1} q
+                     LEFT JOIN {2} USING (survey_question_id)
+                     WHERE survey_question_id = ANY(%s)
+                  """.format(_LOCALE_COLUMN, cls._survey_question_table,
+                             cls._response_type_table)
+            TRN.add(sql, [list(question_ids)], row_type='tuple')
+            definitions = {
+                qid: {'question': question, 'american_question': american,
+                      'response_type': response_type, 'responses': [],
+                      'triggers': {}}
+                for qid, question, american, response_type
+                in TRN.execute_fetchindex()}
+
+            missing = set(question_ids) - set(definitions)
+            if missing:
+                raise ValueError("Questions do not exist: %s" % ', '.join(
+                    map(str, sorted(missing))))
+
+            sql = """SELECT qr.survey_question_id, sr.{0}
+                     FROM {1} qr
+                     JOIN {2} sr
+                         ON qr.response = sr.{0}
+                     WHERE qr.survey_question_id = ANY(%s)
+                     ORDER BY qr.survey_question_id, qr.display_index
+                  """.format(_LOCALE_COLUMN, cls._question_response_table,
+                             cls._response_table)
+            TRN.add(sql, [list(question_ids)], row_type='tuple')
+            for qid, response in TRN.execute_fetchindex():
+                definitions[qid]['responses'].append(response)
+
+            sql = """SELECT sst.survey_question_id, triggered_question,
+                            display_index
                      FROM {0} sst
                      JOIN {1} sqr
                         ON sst.survey_question_id=sqr.survey_question_id
                         AND sqr.response=sst.triggering_response
-                     WHERE sst.survey_question_id = %s
-                     ORDER BY triggered_question
-                 """.format(self._supplemental_survey_table,
-                            self._question_response_table)
-            TRN.add(sql, [self.id])
-            trigger_list = TRN.execute_fetchindex()
-
-            results = defaultdict(list)
-            for question, index in trigger_list:
-                results[question].append(index)
-
-            if results:
-                return results
-            else:
-                return ()
+                     WHERE sst.survey_question_id = ANY(%s)
+                     ORDER BY triggered_question, display_index
+                 """.format(cls._supplemental_survey_table,
+                            cls._question_response_table)
+            TRN.add(sql, [list(question_ids)], row_type='tuple')
+            for qid, question, index in TRN.execute_fetchindex():
+                definitions[qid]['triggers'].setdefault(
+                    question, []).append(index)
+
+            return definitions
+
+    def _triggers(self, definition):
+        """What other question-response combinations this question can trigger
+
+        Parameters
+        ----------
+        definition : dict
+            The definition of the question
+
+        Returns
+        -------
+        tuple
+            (other_question_id, [triggering indices to that question])
+        """
+        results = defaultdict(list)
+        for question, indices in definition['triggers'].items():
+            results[question].extend(indices)
+
+        if results:
+            return results
+        else:
+            return ()
 
     def _interface_elements(self):
         """Can be overridden by subclasses"""
         return ([], [])
 
     @classmethod
-    def factory(cls, ID, name):
+    def factory(cls, ID, name, definition=None):
         """Return the correct class type based on response type"""
-        question = Question(ID, name)
+        if definition is None:
+            definition = cls._fetch_definitions([ID])[ID]
 
-        response_type = question.response_type
+        response_type = definition['response_type']
         question_class = None
 
         if response_type == 'SINGLE':
@@ -137,7 +191,7 @@ class Question(object):
             raise ValueError("Unrecognized response type: %s" %
                              response_type)
 
-        return question_class(question.id, name)
+        return question_class(ID, name, definition)
 
 
 class QuestionSingle(Question):
@@ -190,60 +244,98 @@ class Group(object):
     ----------
     ID : int
         The ID in the database of the question group
+    definitions : dict, optional
+        The definitions of the group and its questions, as returned by
+        `_fetch_definitions`. They are fetched from the database if not
+        provided
+
+    Attributes
+    ----------
+    name : str
+        The locale-specific name of the group
+    american_name : str
+        The american name of the group
     """
     _group_table = 'survey_group'
     _group_questions_table = 'group_questions'
     _questions_table = 'survey_question'
 
-    def __init__(self, ID):
-        with TRN:
-            self.id = ID
-            n = self.american_name
-
-            sql = """SELECT gq.survey_question_id
-                     FROM {0} sg
-                     JOIN {1} gq ON sg.group_order = gq.survey_group
-                     LEFT JOIN {2} sq USING (survey_question_id)
-                     WHERE sg.group_order = %s AND sq.retired = FALSE
-                     ORDER BY gq.display_index
-                  """.format(self._group_table, self._group_questions_table,
-                             self._questions_table)
-            TRN.add(sql, [self.id])
-            results = TRN.execute_fetchindex()
-            qs = [Question.factory(x[0], n) for x in results]
-
-            self.id_to_eid = {q.id: q.interface_element_ids for q in qs}
-
-            self.question_lookup = {q.id: q for q in qs}
-            self.questions = qs
-
-            self.supplemental_eids = set()
-            for q in qs:
-                for id_ in q.triggers:
-                    triggered = self.question_lookup[id_]
-                    triggered_eids = triggered.interface_element_ids
-                    self.supplemental_eids.update(set(triggered_eids))
-
-    @property
-    def name(self):
-        """Gets the locale-specific name of the group"""
+    def __init__(self, ID, definitions=None):
+        if definitions is None:
+            definitions = self._fetch_definitions([ID])
+
+        group = definitions['groups'][ID]
+        self.id = ID
+        self.name = group['name']
+        self.american_name = n = group['american_name']
+
+        qs = [Question.factory(qid, n, definitions['questions'][qid])
+              for qid in group['question_ids']]
+
+        self.id_to_eid = {q.id: q.interface_element_ids for q in qs}
+
+        self.question_lookup = {q.id: q for q in qs}
+        self.questions = qs
+
+        self.supplemental_eids = set()
+        for q in qs:
+            for id_ in q.triggers:
+                triggered = self.question_lookup[id_]
+                triggered_eids = triggered.interface_element_ids
+                self.supplemental_eids.update(set(triggered_eids))
+
+    @classmethod
+    def _fetch_definitions(cls, group_ids):
+        """Fetches the definitions of several groups and their questions
+
+        Parameters
+        ----------
+        group_ids : list of int
+            The IDs of the groups
+
+        Returns
+        -------
+        dict
+            The definition of each group under 'groups', with the keys 'name',
+            'american_name' and 'question_ids' (the IDs of the questions of
+            the group that are not retired, in display order), and the
+            definition of each of those questions under 'questions'
+
+        Raises
+        ------
+        ValueError
+            If any of the groups does not exist
+        """
         with TRN:
-            sql = """SELECT {0}
+            sql = """SELECT group_order, {0}, american
                      FROM {1}
-                     WHERE group_order = %s""".format(_LOCALE_COLUMN,
-                                                      self._group_table)
-            TRN.add(sql, [self.id])
-            return TRN.execute_fetchlast()
-
-    @property
-    def american_name(self):
-        """Gets the locale-specific name of the group"""
-        with TRN:
-            sql = """SELECT american
-                     FROM {0}
-                     WHERE group_order = %s""".format(self._group_table)
-            TRN.add(sql, [self.id])
-            return TRN.execute_fetchlast()
+                     WHERE group_order = ANY(%s)""".format(_LOCALE_COLUMN,
+                                                           cls._group_table)
+            TRN.add(sql, [list(group_ids)], row_type='tuple')
+            groups = {gid: {'name': name, 'american_name': american,
+                            'question_ids': []}
+                      for gid, name, american in TRN.execute_fetchindex()}
+
+            missing = set(group_ids) - set(groups)
+            if missing:
+                raise ValueError("Groups do not exist: %s" % ', '.join(
+                    map(str, sorted(missing))))
+
+            sql = """SELECT gq.survey_group, gq.survey_question_id
+                     FROM {0} gq
+                     JOIN {1} sq USING (survey_question_id)
+                     WHERE gq.survey_group = ANY(%s) AND sq.retired = FALSE
+                     ORDER BY gq.survey_group, gq.display_index
+                  """.format(cls._group_questions_table,
+                             cls._questions_table)
+            TRN.add(sql, [list(group_ids)], row_type='tuple')
+            for gid, qid in TRN.execute_fetchindex():
+                groups[gid]['question_ids'].append(qid)
+
+            question_ids = [qid for group in groups.values()
+                            for qid in group['question_ids']]
+            return {'groups': groups,
+                    'questions': Question._fetch_definitions(question_ids)}
 
 
 class Survey(object):
@@ -253,6 +345,10 @@ class Survey(object):
     ----------
     ID : int
         The ID of the survey in the database
+    definitions : dict, optional
+        The definitions of the survey, its groups and its questions, as
+        returned by `fetch_definitions`. They are fetched from the database if
+        not provided
     """
     _surveys_table = 'surveys'
     _survey_response_table = 'survey_response'
@@ -262,30 +358,84 @@ class Survey(object):
     _survey_answers_other_table = 'survey_answers_other'
     _questions_table = 'survey_question'
 
-    def __init__(self, ID):
+    def __init__(self, ID, definitions=None):
+        if definitions is None:
+            definitions = self.fetch_definitions([ID])
+
         self.id = ID
+        self.groups = [Group(x, definitions)
+                       for x in definitions['surveys'][ID]]
+
+        self.questions = {}
+        self.question_types = {}
+        for group in self.groups:
+            for question in group.questions:
+                self.question_types[question.id] = question.response_type
+                self.questions[question.id] = question
+
+        self.unspecified = definitions['unspecified']
+
+        # Answers are stored by question, but forms work with elements
+        self._element_ids = {qid: q.interface_element_ids[0]
+                             for qid, q in self.questions.items()}
+
+    @classmethod
+    def fetch_definitions(cls, survey_ids=None):
+        """Fetches the definitions of surveys, their groups and questions
+
+        Parameters
+        ----------
+        survey_ids : list of int, optional
+            The IDs of the surveys. Defaults to all the surveys
+
+        Returns
+        -------
+        dict
+            The IDs of the groups of each survey under 'surveys', the
+            localized 'Unspecified' response under 'unspecified', and the
+            definitions of the groups and questions under 'groups' and
+            'questions'
+
+        Raises
+        ------
+        ValueError
+            If any of the surveys does not exist
+
+        Notes
+        -----
+        All the definitions are fetched with a fixed number of queries, no
+        matter how many surveys, groups or questions there are.
+        """
         with TRN:
-            sql = """SELECT survey_group
+            where = '' if survey_ids is None else 'WHERE survey_id = ANY(%s)'
+            sql = """SELECT survey_id, survey_group
                      FROM {0}
-                     WHERE survey_id = %s
-                     ORDER BY survey_group""".format(self._surveys_table)
-            TRN.add(sql, [self.id])
-            results = TRN.execute_fetchflatten()
-            self.groups = [Group(x) for x in results]
-
-            self.questions = {}
-            self.question_types = {}
-            for group in self.groups:
-                for question in group.questions:
-                    self.question_types[question.id] = question.response_type
-                    self.questions[question.id] = question
+                     {1}
+                     ORDER BY survey_id, survey_group
+                  """.format(cls._surveys_table, where)
+            TRN.add(sql, None if survey_ids is None else [list(survey_ids)],
+                    row_type='tuple')
+            surveys = {}
+            for sid, gid in TRN.execute_fetchindex():
+                surveys.setdefault(sid, []).append(gid)
+
+            missing = set(survey_ids or []) - set(surveys)
+            if missing:
+                raise ValueError("Surveys do not exist: %s" % ', '.join(
+                    map(str, sorted(missing))))
+
+            definitions = Group._fetch_definitions(
+                sorted(set(gid for gids in surveys.values() for gid in gids)))
+            definitions['surveys'] = surveys
 
             sql = """SELECT {0}
                      FROM {1}
                      WHERE american='Unspecified'
-                  """.format(_LOCALE_COLUMN, self._survey_response_table)
+                  """.format(_LOCALE_COLUMN, cls._survey_response_table)
             TRN.add(sql)
-            self.unspecified = TRN.execute_fetchlast()
+            definitions['unspecified'] = TRN.execute_fetchlast()
+
+            return definitions
 
     def fetch_survey(self, survey_id):
         """Return {element_id: answer}
@@ -295,45 +445,44 @@ class Survey(object):
         input into a WTForm.
         """
         with TRN:
-            sql = """SELECT survey_question_id, display_index,
-                            survey_response_type
+            # Answers with a response from the list of responses of their
+            # question have a display index, free text answers a response.
+            # Free text answers come last, so they take precedence
+            sql = """SELECT FALSE AS other, survey_question_id, display_index,
+                            survey_response_type, NULL AS response
                      FROM {0}
                      JOIN {1} USING (response, survey_question_id)
                      JOIN {2} USING (survey_question_id)
-                     LEFT JOIN {3} USING (survey_question_id)
-                     WHERE survey_id = %s AND retired = FALSE""".format(
+                     JOIN {3} USING (survey_question_id)
+                     WHERE survey_id = %s AND retired = FALSE
+                     UNION ALL
+                     SELECT TRUE, survey_question_id, NULL, NULL, response
+                     FROM {4}
+                     JOIN {3} USING (survey_question_id)
+                     WHERE survey_id = %s AND retired = FALSE
+                     ORDER BY other""".format(
                 self._survey_answers_table,
                 self._survey_question_response_table,
                 self._survey_question_response_type_table,
-                self._questions_table)
-            TRN.add(sql, [survey_id])
+                self._questions_table, self._survey_answers_other_table)
+            TRN.add(sql, [survey_id, survey_id], row_type='tuple')
             answers = TRN.execute_fetchindex()
 
-            TRN.add("""SELECT survey_question_id, response
-                       FROM {0}
-                       LEFT JOIN {1} using (survey_question_id)
-                       WHERE survey_id = %s AND retired = FALSE""".format(
-                self._survey_answers_other_table, self._questions_table),
-                [survey_id])
-            answers_other = TRN.execute_fetchindex()
-
-            survey = defaultdict(list)
-            for qid, idx, qtype in answers:
-                eid = self.questions[qid].interface_element_ids[0]
-                if qtype == 'SINGLE':
-                    survey[eid] = idx
-                else:
-                    survey[eid].append(idx)
-
-            for qid, data in answers_other:
-                eid = self.questions[qid].interface_element_ids[0]
-                data = data.strip(' []"')
-                survey[eid] = data
-
-            if len(survey) == 0:
-                raise ValueError("Survey answers do not exist in DB: %s" %
-                                 survey_id)
-            return survey
+        element_ids = self._element_ids
+        survey = defaultdict(list)
+        for other, qid, idx, qtype, data in answers:
+            eid = element_ids[qid]
+            if other:
+                survey[eid] = data.strip(' []"')
+            elif qtype == 'SINGLE':
+                survey[eid] = idx
+            else:
+                survey[eid].append(idx)
+
+        if len(survey) == 0:
+            raise ValueError("Survey answers do not exist in DB: %s" %
+                             survey_id)
+        return survey
 
     def store_survey(self, consent_details, with_fk_inserts,
                      without_fk_inserts):
@@ -402,3 +551,88 @@ class Survey(object):
             TRN.add("""INSERT INTO survey_answers_other
                            (survey_id,survey_question_id, response)
                        VALUES (%s, %s, %s)""", without_fk_inserts, many=True)
+
+
+def _current_patch():
+    """Returns the last patch applied to the database"""
+    with TRN:
+        TRN.add("SELECT current_patch FROM settings")
+        return TRN.execute_fetchlast()
+
+
+def build_snapshot(snapshot_fp=SNAPSHOT_FP):
+    """Writes the definitions of all the surveys to disk
+
+    Parameters
+    ----------
+    snapshot_fp : str, optional
+        The path of the snapshot. Defaults to `SNAPSHOT_FP`
+
+    Notes
+    -----
+    The snapshot is only used while the database is at the same patch and the
+    site uses the same locale it was built with. It must only be writable by
+    the site, as it is unpickled by every worker.
+    """
+    snapshot = {'current_patch': _current_patch(),
+                'locale': AMGUT_CONFIG.locale,
+                'definitions': Survey.fetch_definitions()}
+
+    # Workers never see a partially written snapshot
+    tmp_fp = '%s.%d.tmp' % (snapshot_fp, getpid())
+    with open(tmp_fp, 'wb') as f:
+        dump(snapshot, f, HIGHEST_PROTOCOL)
+    rename(tmp_fp, snapshot_fp)
+
+
+def _load_snapshot(snapshot_fp):
+    """Returns the definitions in a snapshot, or None if missing or stale"""
+    try:
+        with open(snapshot_fp, 'rb') as f:
+            snapshot = load(f)
+        locale = snapshot['locale']
+        patch = snapshot['current_patch']
+        definitions = snapshot['definitions']
+    except IOError:
+        return None
+    except Exception as e:
+        # Unpickling a damaged or outdated file can raise nearly anything, and
+        # the definitions can always be fetched from the database instead
+        logging.warning('Ignoring unreadable survey snapshot %s: %r'
+                        % (snapshot_fp, e))
+        return None
+
+    if locale != AMGUT_CONFIG.locale or patch != _current_patch():
+        return None
+    return definitions
+
+
+def load_surveys(survey_ids=None, snapshot_fp=SNAPSHOT_FP):
+    """Builds several surveys, fetching all their definitions at once
+
+    Parameters
+    ----------
+    survey_ids : list of int, optional
+        The IDs of the surveys. Defaults to all the surveys
+    snapshot_fp : str, optional
+        The path of the snapshot of the definitions, as written by
+        `build_snapshot`. Defaults to `SNAPSHOT_FP`
+
+    Returns
+    -------
+    dict of {int: Survey}
+        The surveys keyed by ID
+
+    Notes
+    -----
+    The definitions are read from the snapshot if it is up to date, and
+    fetched from the database otherwise.
+    """
+    definitions = _load_snapshot(snapshot_fp)
+    if definitions is None or (survey_ids is not None and
+                               set(survey_ids) - set(definitions['surveys'])):
+        definitions = Survey.fetch_definitions(survey_ids)
+
+    if survey_ids is None:
+        survey_ids = definitions['surveys']
+    return {sid: Survey(sid, definitions) for sid in survey_ids}
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The American Gut Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+"""
+Compares the time it takes to gather the data of the portal page using
+AGDataAccess.get_portal_data against the sequence of calls it replaces
+
+Usage: python benchmark_portal.py [--kit-id KIT_ID] [--repeat N]
+"""
+
+from __future__ import division
+from timeit import repeat
+
+import click
+
+from amgut.lib.data_access.ag_data_access import AGDataAccess
+
+
+def portal_data_sequence(ag_data, kit_id):
+    """The calls previously made by PortalHandler to render the portal"""
+    return (ag_data.get_user_info(kit_id),
+            ag_data.getAGKitDetails(kit_id),
+            ag_data.get_barcode_results(kit_id),
+            ag_data.getBarcodesByKit(kit_id),
+            ag_data.get_nonconsented_scanned_barcodes(kit_id))
+
+
+@click.command()
+@click.option('--kit-id', default='tst_yCzro', help='The supplied kit ID')
+@click.option('--repeat', 'repetitions', default=5,
+              help='Number of times each timing is repeated')
+@click.option('--number', default=100,
+              help='Number of calls made in each timing')
+def benchmark(kit_id, repetitions, number):
+    """Times the portal data retrieval, reporting the best ms per call"""
+    ag_data = AGDataAccess()
+    for name, func in [
+            ('sequence', lambda: portal_data_sequence(ag_data, kit_id)),
+            ('get_portal_data', lambda: ag_data.get_portal_data(kit_id))]:
+        best = min(repeat(func, repeat=repetitions, number=number))
+        click.echo('%-16s %8.3f ms' % (name, best / number * 1000))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -4,7 +4,12 @@ from random import choice, randint
 from string import ascii_letters
 from uuid import UUID
 
-from amgut.lib.data_access.ag_data_access import AGDataAccess
+from mock import patch
+from tornado.ioloop import IOLoop
+
+from amgut.lib.data_access.ag_data_access import (AGDataAccess,
+                                                  AsyncAGDataAccess)
+from amgut.lib.data_access.sql_connection import TRN
 from amgut.lib.util import rollback
 
 
@@ -31,6 +36,25 @@ class TestAGDataAccess(TestCase):
         self.assertEqual(obs['ag_login_id'],
                          'ded5101d-cafb-f6b3-e040-8a80115d6f03')
 
+    def test_check_login(self):
+        self.assertEqual(self.ag_data.check_login('randomkitID', 'test'),
+                         (None, None))
+        self.assertEqual(self.ag_data.check_login('tst_xfphP', 'wrongPass'),
+                         (None, None))
+
+        kit_type, obs = self.ag_data.check_login('tst_xfphP', 'test')
+        self.assertEqual(kit_type, 'kit')
+        self.assertEqual(obs['ag_login_id'],
+                         'ded5101d-cafb-f6b3-e040-8a80115d6f03')
+        self.assertEqual(obs, self.ag_data.authenticateWebAppUser(
+            'tst_xfphP', 'test'))
+
+        kit = self.ag_data.get_all_handout_kits()[0]
+        self.assertEqual(self.ag_data.check_login(kit, 'test'),
+                         ('handout', None))
+        self.assertEqual(self.ag_data.check_login(kit, 'badPass'),
+                         (None, None))
+
     def test_check_login_exists(self):
         email = 'Reallylongemailthatshouldntexist@someplacenotreal.com'
         obs = self.ag_data.check_login_exists(email)
@@ -134,6 +158,11 @@ class TestAGDataAccess(TestCase):
         for kit_id in obs:
             self.assertRegexpMatches(kit_id, 'tst_[a-zA-Z]{5}')
 
+    def test_iter_all_handout_kits(self):
+        obs = self.ag_data.iter_all_handout_kits(fetch_size=2)
+        self.assertFalse(isinstance(obs, list))
+        self.assertItemsEqual(obs, self.ag_data.get_all_handout_kits())
+
     def test_registerHandoutKit_bad_data(self):
         # run on bad data
         with self.assertRaises(ValueError):
@@ -152,6 +181,18 @@ class TestAGDataAccess(TestCase):
         obs = self.ag_data.registerHandoutKit(ag_login_id, kit)
         self.assertFalse(obs)
 
+    @rollback
+    def test_registerHandoutKit_registered(self):
+        # A handout kit whose ID is already used by a registered kit
+        TRN.add("""INSERT INTO ag.ag_handout_kits
+                   (kit_id, password, verification_code, swabs_per_kit)
+                   VALUES ('tst_ULGcr', 'test', 'test', 1)""")
+        TRN.execute()
+        ag_login_id = 'dc3172b2-792c-4087-8a20-714297821c6a'
+        with patch('amgut.lib.data_access.ag_data_access.logging'):
+            obs = self.ag_data.registerHandoutKit(ag_login_id, 'tst_ULGcr')
+        self.assertFalse(obs)
+
     def test_registerHandoutKit(self):
         # run on real data
         ag_login_id = 'dc3172b2-792c-4087-8a20-714297821c6a'
@@ -164,6 +205,39 @@ class TestAGDataAccess(TestCase):
         obs = self.ag_data.getAGKitDetails(kit)
         self.assertEqual(obs['supplied_kit_id'], kit)
 
+    @rollback
+    def test_register_handout_kits(self):
+        ag_login_id = 'dc3172b2-792c-4087-8a20-714297821c6a'
+        kits = self.ag_data.get_all_handout_kits()[:3]
+        TRN.add("SELECT barcode FROM ag.ag_handout_barcodes "
+                "WHERE kit_id = ANY(%s)", [kits[:2]])
+        barcodes = TRN.execute_fetchflatten()
+
+        obs = self.ag_data.register_handout_kits(
+            [(ag_login_id, kits[0]), (ag_login_id, 'NoTR3AL'),
+             ('877bb1b5-7352-48bf-a7b1-1248c689b819', kits[2]),
+             (ag_login_id, kits[1])])
+        self.assertItemsEqual(obs, kits[:2])
+
+        handout_kits = self.ag_data.get_all_handout_kits()
+        self.assertIn(kits[2], handout_kits)
+        for kit in kits[:2]:
+            self.assertNotIn(kit, handout_kits)
+            self.assertEqual(self.ag_data.get_user_for_kit(kit), ag_login_id)
+        self.assertItemsEqual(self.ag_data.getBarcodesByKit(kits[0]) +
+                              self.ag_data.getBarcodesByKit(kits[1]),
+                              barcodes)
+
+    def test_register_handout_kits_errors(self):
+        self.assertEqual(self.ag_data.register_handout_kits([]), [])
+
+        ag_login_id = 'dc3172b2-792c-4087-8a20-714297821c6a'
+        with self.assertRaises(ValueError):
+            self.ag_data.register_handout_kits([('BAD', 'DATA')])
+        with self.assertRaises(ValueError):
+            self.ag_data.register_handout_kits(
+                [(ag_login_id, 'DATA'), (ag_login_id, 'DATA')])
+
     @rollback
     def test_deleteAGParticipantSurvey(self):
         self.ag_data.deleteAGParticipantSurvey(
@@ -173,9 +247,10 @@ class TestAGDataAccess(TestCase):
 
         res = self.ag_data.get_withdrawn()
         today = datetime.datetime.now().date()
-        exp = [['000fc4cd-8fa4-db8b-e050-8a800c5d02b5', 'REMOVED-0',
-                'REMOVED', today]]
+        exp = [('000fc4cd-8fa4-db8b-e050-8a800c5d02b5', 'REMOVED-0',
+                'REMOVED', today)]
         self.assertItemsEqual(res, exp)
+        self.assertItemsEqual(self.ag_data.iter_withdrawn(fetch_size=1), exp)
 
     def test_getConsent(self):
         res = self.ag_data.getConsent("8b2b45bb3390b585")
@@ -503,6 +578,16 @@ class TestAGDataAccess(TestCase):
         obs = self.ag_data.check_access('tst_BudVu', '000001111')
         self.assertEqual(obs, False)
 
+    def test_check_access_many(self):
+        obs = self.ag_data.check_access_many(
+            'tst_BudVu', ['000001047', '000001111'])
+        self.assertEqual(obs, {'000001047': True, '000001111': False})
+
+        self.assertEqual(self.ag_data.check_access_many('tst_BudVu', []), {})
+
+        with self.assertRaises(ValueError):
+            self.ag_data.check_access_many('tst_esXXX', ['000001047'])
+
     def test_ag_set_pass_change_code(self):
         # Generate new random code and assign it
         testcode = ''.join(choice(ascii_letters) for i in range(10))
@@ -604,6 +689,17 @@ class TestAGDataAccess(TestCase):
         obs = self.ag_data.get_user_for_kit('tst_esABz')
         self.assertEqual('d8592c74-8421-2135-e040-8a80115d6401', obs)
 
+    def test_get_user_for_kit_cache(self):
+        exp = 'd8592c74-8421-2135-e040-8a80115d6401'
+        self.assertEqual(self.ag_data._login_ids.get('tst_esABz'), None)
+        self.assertEqual(self.ag_data.get_user_for_kit('tst_esABz'), exp)
+        self.assertEqual(self.ag_data._login_ids.get('tst_esABz'), exp)
+
+        # Authenticating primes the cache
+        self.ag_data.authenticateWebAppUser('tst_xfphP', 'test')
+        self.assertEqual(self.ag_data._login_ids.get('tst_xfphP'),
+                         'ded5101d-cafb-f6b3-e040-8a80115d6f03')
+
     def test_get_user_for_kit_errors(self):
         with self.assertRaises(ValueError):
             self.ag_data.get_user_for_kit('the_fooster')
@@ -618,6 +714,30 @@ class TestAGDataAccess(TestCase):
         obs = self.ag_data.get_menu_items('tst_VpQsT')
         self.assertEqual(({'REMOVED-0': []}, {}, [], True), obs)
 
+    def test_get_menu_items_participants(self):
+        # The menu matches the per-participant lookups it replaces
+        logins = ['d8592c74-9694-2135-e040-8a80115d6401',
+                  'ed5ab96f-fe3b-ead5-e040-8a80115d1c4b',
+                  'd6b0f287-b9d9-40d4-82fd-a8fd3db6c476']
+        for ag_login_id in logins:
+            with TRN:
+                TRN.add("SELECT supplied_kit_id FROM ag.ag_kit "
+                        "WHERE ag_login_id = %s", [ag_login_id])
+                kit_id = TRN.execute_fetchlast()
+
+            human, animal, env, _ = self.ag_data.get_menu_items(kit_id)
+            self.assertItemsEqual(
+                human, self.ag_data.getHumanParticipants(ag_login_id))
+            self.assertItemsEqual(
+                animal, self.ag_data.getAnimalParticipants(ag_login_id))
+            for participants in (human, animal):
+                for name, samples in participants.items():
+                    self.assertItemsEqual(
+                        samples,
+                        self.ag_data.getParticipantSamples(ag_login_id, name))
+            self.assertItemsEqual(
+                env, self.ag_data.getEnvironmentalSamples(ag_login_id))
+
     def test_get_menu_items_errors(self):
         with self.assertRaises(ValueError):
             self.ag_data.get_menu_items('tst_esXXX')
@@ -668,6 +788,25 @@ class TestAGDataAccess(TestCase):
         with self.assertRaises(ValueError):
             self.ag_data.get_barcode_results("something that doesn't exist")
 
+    def test_get_portal_data(self):
+        for kit_id in ['tst_yCzro', 'tst_KWfyv', 'tst_qmhLX', 'tst_ODmhG']:
+            obs = self.ag_data.get_portal_data(kit_id)
+            self.assertEqual(obs['user_info'],
+                             self.ag_data.get_user_info(kit_id))
+            self.assertEqual(obs['kit_details'],
+                             self.ag_data.getAGKitDetails(kit_id))
+            self.assertItemsEqual(obs['results'],
+                                  self.ag_data.get_barcode_results(kit_id))
+            self.assertItemsEqual(obs['barcodes'],
+                                  self.ag_data.getBarcodesByKit(kit_id))
+            self.assertItemsEqual(
+                obs['unconsented'],
+                self.ag_data.get_nonconsented_scanned_barcodes(kit_id))
+
+    def test_get_portal_data_non_existent(self):
+        with self.assertRaises(ValueError):
+            self.ag_data.get_portal_data('tst_XX1123')
+
     def test_get_login_info(self):
         id_ = 'fecebeae-4244-2d78-e040-8a800c5d4f50'
         exp = [{'ag_login_id': id_,
@@ -706,6 +845,70 @@ class TestAGDataAccess(TestCase):
         self.assertIn('United States', obs)
         self.assertIn('United Kingdom', obs)
 
+    def test_get_countries_cache(self):
+        obs = self.ag_data.get_countries()
+        obs.append('Nowhere')
+        self.assertNotIn('Nowhere', self.ag_data.get_countries())
+
+        self.ag_data._reference_data.set('countries', ['Nowhere'])
+        self.assertEqual(self.ag_data.get_countries(), ['Nowhere'])
+
+    def test_getMapMarkers_cache(self):
+        obs = self.ag_data.getMapMarkers()
+        self.assertIn('United Kingdom', obs)
+        obs['Nowhere'] = 1
+        self.assertNotIn('Nowhere', self.ag_data.getMapMarkers())
+
+        # The cached counts are used until a new login is committed
+        self.ag_data._reference_data.set('map_markers', {'Nowhere': 1})
+        with TRN:
+            self.ag_data.addAGLogin(
+                'test@EMAIL.com', 'TESTDUDE', '123 fake test street',
+                'testcity', 'teststate', '1L2 2G3', 'United Kingdom')
+        self.assertEqual(self.ag_data.getMapMarkers(), {'Nowhere': 1})
+
+        email = 'new_%s@test.com' % randint(0, 10**9)
+        try:
+            with TRN:
+                self.ag_data.addAGLogin(
+                    email, 'TESTDUDE', '123 fake test street', 'testcity',
+                    'teststate', '1L2 2G3', 'United Kingdom')
+                self.assertEqual(self.ag_data.getMapMarkers(),
+                                 {'Nowhere': 1})
+            self.assertNotEqual(self.ag_data.getMapMarkers(), {'Nowhere': 1})
+        finally:
+            with TRN:
+                TRN.add("DELETE FROM ag.ag_login WHERE email = %s", [email])
+
+    @rollback
+    def test_getMapMarkers(self):
+        TRN.add("""SELECT country, count(country)::integer
+                   FROM ag.ag_login GROUP BY country""")
+        exp = dict(TRN.execute_fetchindex())
+        self.assertEqual(self.ag_data.getMapMarkers(), exp)
+
+        # The counts follow the changes to the logins
+        ag_login_id = self.ag_data.addAGLogin(
+            'new_%s@test.com' % randint(0, 10**9), 'TESTDUDE',
+            '123 fake test street', 'testcity', 'teststate', '1L2 2G3',
+            'Nowhere')
+        self.ag_data._reference_data.invalidate()
+        self.assertEqual(self.ag_data.getMapMarkers()['Nowhere'], 1)
+
+        TRN.add("UPDATE ag.ag_login SET country = %s WHERE ag_login_id = %s",
+                ['United Kingdom', ag_login_id])
+        TRN.execute()
+        self.ag_data._reference_data.invalidate()
+        obs = self.ag_data.getMapMarkers()
+        self.assertNotIn('Nowhere', obs)
+        self.assertEqual(obs['United Kingdom'], exp['United Kingdom'] + 1)
+
+        TRN.add("DELETE FROM ag.ag_login WHERE ag_login_id = %s",
+                [ag_login_id])
+        TRN.execute()
+        self.ag_data._reference_data.invalidate()
+        self.assertEqual(self.ag_data.getMapMarkers(), exp)
+
     def test_is_deposited_ebi(self):
         obs = self.ag_data.is_deposited_ebi('000027262')
         self.assertFalse(obs)
@@ -714,6 +917,74 @@ class TestAGDataAccess(TestCase):
         with self.assertRaises(ValueError):
             self.ag_data.is_deposited_ebi('NOTABARCODE')
 
+    def test_deposited_ebi_many(self):
+        obs = self.ag_data.deposited_ebi_many(['000027262', '000001047'])
+        exp = {'000027262': self.ag_data.is_deposited_ebi('000027262'),
+               '000001047': self.ag_data.is_deposited_ebi('000001047')}
+        self.assertEqual(obs, exp)
+
+        self.assertEqual(self.ag_data.deposited_ebi_many([]), {})
+
+        with self.assertRaises(ValueError):
+            self.ag_data.deposited_ebi_many(['000027262', 'NOTABARCODE'])
+
+
+class TestAsyncAGDataAccess(TestCase):
+    def setUp(self):
+        self.ag_data_async = AsyncAGDataAccess()
+
+    def test_method(self):
+        obs = self.ag_data_async.get_user_for_kit('tst_IueFX').result()
+        self.assertEqual('ded5101d-c8e3-f6b3-e040-8a80115d6f03', obs)
+
+    def test_method_error(self):
+        future = self.ag_data_async.get_user_for_kit('the_fooster')
+        with self.assertRaises(ValueError):
+            future.result()
+
+    def test_attribute(self):
+        self.assertEqual(self.ag_data_async.animal_sites,
+                         AGDataAccess.animal_sites)
+
+    def _run(self, method, *args):
+        return IOLoop.current().run_sync(lambda: method(*args))
+
+    def test_authenticateWebAppUser(self):
+        login = self.ag_data_async.authenticateWebAppUser
+        self.assertEqual(self._run(login, 'randomkitID', 'test'), False)
+        self.assertEqual(self._run(login, 'tst_xfphP', 'wrongPass'), False)
+
+        obs = self._run(login, 'tst_xfphP', 'test')
+        self.assertEqual(obs['ag_login_id'],
+                         'ded5101d-cafb-f6b3-e040-8a80115d6f03')
+
+    def test_check_login(self):
+        login = self.ag_data_async.check_login
+        self.assertEqual(self._run(login, 'tst_xfphP', 'wrongPass'),
+                         (None, None))
+        kit_type, obs = self._run(login, 'tst_xfphP', 'test')
+        self.assertEqual(kit_type, 'kit')
+        self.assertEqual(obs['ag_login_id'],
+                         'ded5101d-cafb-f6b3-e040-8a80115d6f03')
+
+        kit = AGDataAccess().get_all_handout_kits()[0]
+        self.assertEqual(self._run(login, kit, 'test'), ('handout', None))
+
+    def test_handoutCheck(self):
+        kit = AGDataAccess().get_all_handout_kits()[0]
+        check = self.ag_data_async.handoutCheck
+        self.assertEqual(self._run(check, kit, 'test'), True)
+        self.assertEqual(self._run(check, kit, 'badPass'), False)
+        self.assertEqual(self._run(check, 'tst_ODmhG', 'test'), False)
+
+    def test_ag_update_kit_password(self):
+        newpass = ''.join(choice(ascii_letters) for i in range(randint(8, 15)))
+        self._run(self.ag_data_async.ag_update_kit_password, 'tst_ULGcr',
+                  newpass)
+        obs = AGDataAccess().authenticateWebAppUser('tst_ULGcr', newpass)
+        self.assertEqual(obs['ag_login_id'],
+                         'd8592c74-8416-2135-e040-8a80115d6401')
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,54 @@
+from unittest import TestCase, main
+from time import sleep
+
+from amgut.lib.data_access.cache import TTLCache
+
+
+class TestTTLCache(TestCase):
+    def test_init_error(self):
+        with self.assertRaises(ValueError):
+            TTLCache(0, 10)
+
+    def test_get_set(self):
+        cache = TTLCache(10, 60)
+        self.assertEqual(cache.get('foo'), None)
+        self.assertEqual(cache.get('foo', 'default'), 'default')
+        cache.set('foo', 'bar')
+        self.assertEqual(cache.get('foo'), 'bar')
+        cache.set('foo', 'baz')
+        self.assertEqual(cache.get('foo'), 'baz')
+        self.assertEqual(len(cache), 1)
+
+    def test_max_size(self):
+        cache = TTLCache(2, 60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # Using 'a' makes 'b' the least recently used entry
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_ttl(self):
+        cache = TTLCache(10, 0.1)
+        cache.set('foo', 'bar')
+        sleep(0.2)
+        self.assertEqual(cache.get('foo'), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        cache = TTLCache(10, 60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.invalidate('a')
+        cache.invalidate('missing')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+from unittest import TestCase, main
+from os import close, remove
+from tempfile import mkstemp
+
+from passlib.hash import bcrypt
+
+from amgut.lib.data_access.env_management import (
+    import_handout_kits, rebuild_country_counts)
+from amgut.lib.data_access.sql_connection import TRN
+from amgut.lib.util import rollback
+
+
+class TestImportHandoutKits(TestCase):
+    def setUp(self):
+        self._files_to_remove = []
+
+    def tearDown(self):
+        for fp in self._files_to_remove:
+            remove(fp)
+
+    def _write_kits(self, contents, suffix):
+        fd, fp = mkstemp(suffix=suffix)
+        close(fd)
+        self._files_to_remove.append(fp)
+        with open(fp, 'w') as f:
+            f.write(contents)
+        return fp
+
+    @rollback
+    def test_import_handout_kits(self):
+        barcodes = ['999990001', '999990002', '999990003']
+        TRN.add("INSERT INTO barcodes.barcode (barcode) VALUES (%s)",
+                [[b] for b in barcodes], many=True)
+        fp = self._write_kits(
+            "kit_id\tpassword\tverification_code\tbarcodes\n"
+            "tst_imp01\tpass01\t12345\t999990001 999990002\n"
+            "tst_imp02\tpass02\t54321\t999990003\n", '.tsv')
+
+        progress = []
+        obs = import_handout_kits(fp, chunk_size=1, processes=1,
+                                  callback=progress.append)
+        self.assertEqual(obs, 2)
+        self.assertEqual(progress, [1, 1])
+
+        TRN.add("""SELECT kit_id, password, verification_code, swabs_per_kit
+                   FROM ag.ag_handout_kits
+                   WHERE kit_id IN ('tst_imp01', 'tst_imp02')
+                   ORDER BY kit_id""")
+        kits = TRN.execute_fetchindex()
+        self.assertEqual([(k[0], k[2], k[3]) for k in kits],
+                         [('tst_imp01', '12345', 2),
+                          ('tst_imp02', '54321', 1)])
+        self.assertTrue(bcrypt.verify('pass01', kits[0][1]))
+        self.assertTrue(bcrypt.verify('pass02', kits[1][1]))
+
+        TRN.add("""SELECT kit_id, barcode FROM ag.ag_handout_barcodes
+                   WHERE barcode = ANY(%s) ORDER BY barcode""", [barcodes])
+        self.assertEqual([tuple(r) for r in TRN.execute_fetchindex()],
+                         [('tst_imp01', '999990001'),
+                          ('tst_imp01', '999990002'),
+                          ('tst_imp02', '999990003')])
+
+    def test_import_handout_kits_errors(self):
+        fp = self._write_kits("kit_id,password,barcodes\n"
+                              "tst_imp01,pass01,000000001\n", '.csv')
+        with self.assertRaises(ValueError):
+            import_handout_kits(fp, processes=1)
+
+        fp = self._write_kits("kit_id,password,verification_code,barcodes\n"
+                              "tst_imp01,pass01,,000000001\n", '.csv')
+        with self.assertRaises(ValueError):
+            import_handout_kits(fp, processes=1)
+
+        # Barcodes that do not exist are not loaded
+        fp = self._write_kits("kit_id,password,verification_code,barcodes\n"
+                              "tst_imp01,pass01,12345,not_a_barcode\n",
+                              '.csv')
+        with self.assertRaises(ValueError):
+            import_handout_kits(fp, processes=1)
+
+        sql = "SELECT COUNT(*) FROM ag.ag_handout_kits WHERE kit_id = %s"
+        with TRN:
+            TRN.add(sql, ['tst_imp01'])
+            self.assertEqual(TRN.execute_fetchlast(), 0)
+
+
+class TestRebuildCountryCounts(TestCase):
+    @rollback
+    def test_rebuild_country_counts(self):
+        sql = """SELECT country, num_logins FROM ag.login_country_counts
+                 WHERE num_logins > 0"""
+        TRN.add(sql)
+        exp = dict(TRN.execute_fetchindex())
+        TRN.add("UPDATE ag.login_country_counts SET num_logins = 0")
+
+        rebuild_country_counts()
+        TRN.add(sql)
+        self.assertEqual(dict(TRN.execute_fetchindex()), exp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+from unittest import TestCase, main
+
+from mock import patch
+
+from amgut.lib.data_access.query_stats import (
+    QueryStats, fingerprint, HISTOGRAM_BOUNDS)
+from amgut.lib.data_access.sql_connection import TRN, QUERY_STATS
+
+
+class TestQueryStats(TestCase):
+    def setUp(self):
+        self.stats = QueryStats(100)
+
+    def test_fingerprint(self):
+        obs = fingerprint("""SELECT *  FROM ag_login
+                             WHERE email = %s AND kit_id IN ('a''b', 'c')
+                             LIMIT 10""")
+        exp = ("SELECT * FROM ag_login WHERE email = ? AND kit_id IN (?, ?) "
+               "LIMIT ?")
+        self.assertEqual(obs, exp)
+        self.assertEqual(fingerprint("SELECT %(foo)s, $1 FROM table2"),
+                         "SELECT ?, ? FROM table2")
+
+    def test_record(self):
+        with patch('amgut.lib.data_access.query_stats.logging'):
+            self.stats.record("SELECT %s", 0.002, 1, 'AGDataAccess.foo')
+            self.stats.record("SELECT  1", 0.300, 1, 'AGDataAccess.bar')
+            self.stats.record("DELETE FROM t", 0.001, 5, 'AGDataAccess.foo')
+
+        obs = self.stats.summary()
+        self.assertEqual([s['query'] for s in obs],
+                         ['SELECT ?', 'DELETE FROM t'])
+        obs = obs[0]
+        self.assertEqual(obs['count'], 2)
+        self.assertAlmostEqual(obs['total_ms'], 302)
+        self.assertAlmostEqual(obs['max_ms'], 300)
+        self.assertEqual(obs['rows'], 2)
+        self.assertEqual(obs['callers'],
+                         ['AGDataAccess.bar', 'AGDataAccess.foo'])
+        exp = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        exp[1] = 1
+        exp[7] = 1
+        self.assertEqual(obs['histogram'], exp)
+
+        self.assertEqual(len(self.stats.summary(reset=True)), 2)
+        self.assertEqual(self.stats.summary(), [])
+
+        self.stats.record("SELECT 1", 0.001, 1, 'AGDataAccess.foo')
+        self.stats.reset()
+        self.assertEqual(self.stats.summary(), [])
+
+    def test_record_slow(self):
+        with patch('amgut.lib.data_access.query_stats.logging') as log:
+            self.stats.record("SELECT 1", 0.050, 1, 'AGDataAccess.foo')
+            self.assertFalse(log.warning.called)
+            self.stats.record("SELECT 1", 0.150, 1, 'AGDataAccess.foo')
+            self.assertEqual(log.warning.call_count, 1)
+            self.assertIn('AGDataAccess.foo', log.warning.call_args[0][0])
+
+            self.stats.slow_query_ms = -1
+            self.stats.record("SELECT 1", 10, 1, 'AGDataAccess.foo')
+            self.assertEqual(log.warning.call_count, 1)
+
+    def test_log_summary(self):
+        with patch('amgut.lib.data_access.query_stats.logging') as log:
+            self.stats.log_summary()
+            self.assertFalse(log.warning.called)
+
+            self.stats.record("SELECT 1", 0.002, 1, 'AGDataAccess.foo')
+            self.stats.record("SELECT 2", 0.001, 1, 'AGDataAccess.foo')
+            self.stats.record("DELETE FROM t", 0.010, 4, 'AGDataAccess.bar')
+            self.stats.log_summary(limit=1)
+            self.assertEqual(log.warning.call_count, 1)
+            obs = log.warning.call_args[0][0].splitlines()
+            self.assertEqual(len(obs), 3)
+            self.assertIn('2 queries, 3 statements', obs[0])
+            self.assertTrue(obs[1].endswith('DELETE FROM t'))
+            self.assertTrue(obs[2].endswith('AGDataAccess.bar'))
+
+        # The statistics start again after each dump
+        self.assertEqual(self.stats.summary(), [])
+
+    def test_transaction(self):
+        QUERY_STATS.reset()
+        with TRN:
+            TRN.add("SELECT 42")
+            TRN.execute()
+        obs = QUERY_STATS.summary()
+        self.assertEqual(len(obs), 1)
+        self.assertEqual(obs[0]['query'], 'SELECT ?')
+        self.assertEqual(obs[0]['rows'], 1)
+        self.assertEqual(obs[0]['callers'],
+                         ['TestQueryStats.test_transaction'])
+
+    def test_transaction_pipeline(self):
+        QUERY_STATS.reset()
+        with TRN:
+            sql = "DELETE FROM ag.ag_login WHERE email = %s"
+            TRN.add(sql, ['nobody1@test.com'])
+            TRN.add(sql, ['nobody2@test.com'])
+            TRN.add("SELECT 42")
+            TRN.execute()
+            TRN.rollback()
+        # The round trip is recorded once, with the time it really took
+        obs = QUERY_STATS.summary()
+        self.assertEqual(len(obs), 1)
+        self.assertEqual(obs[0]['query'],
+                         'DELETE FROM ag.ag_login WHERE email = ?; '
+                         'DELETE FROM ag.ag_login WHERE email = ?; SELECT ?')
+        self.assertEqual(obs[0]['count'], 1)
+        self.assertEqual(obs[0]['rows'], 1)
+        self.assertEqual(obs[0]['callers'],
+                         ['TestQueryStats.test_transaction_pipeline'])
+
+    def test_transaction_iter(self):
+        QUERY_STATS.reset()
+        with TRN:
+            obs = TRN.execute_iter("SELECT generate_series(1, %s)", [5],
+                                   fetch_size=2)
+            self.assertEqual(QUERY_STATS.summary(), [])
+            self.assertEqual(len(list(obs)), 5)
+        obs = QUERY_STATS.summary()
+        self.assertEqual(len(obs), 1)
+        self.assertEqual(obs[0]['query'], 'SELECT generate_series(?, ?)')
+        self.assertEqual(obs[0]['count'], 1)
+        self.assertEqual(obs[0]['rows'], 5)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,18 @@ from unittest import TestCase, main
 from os import remove, close
 from os.path import exists
 from tempfile import mkstemp
+from threading import Thread, Event
+from Queue import Queue
 
+from mock import patch
 from psycopg2._psycopg import connection
 from psycopg2 import connect
 from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 
-from amgut.lib.data_access.sql_connection import Transaction, TRN
+from amgut.lib.data_access.sql_connection import (
+    Transaction, TRN, ConnectionPool, PreparedStatement, get_transaction,
+    bind_transaction, run_async, _returns_no_rows, _continues_insert, POOL,
+    EXECUTOR)
 from amgut.lib.config_manager import AMGUT_CONFIG
 
 
@@ -72,8 +78,9 @@ class TestTransaction(TestBase):
         self.assertEqual(obs._connection, None)
         self.assertEqual(obs._contexts_entered, 0)
         with obs:
-            pass
-        self.assertTrue(isinstance(obs._connection, connection))
+            self.assertTrue(isinstance(obs._connection, connection))
+        # The connection is given back to the pool when leaving the context
+        self.assertEqual(obs._connection, None)
 
     def test_add(self):
         with TRN:
@@ -107,6 +114,35 @@ class TestTransaction(TestBase):
             exp = [(sql, [1]), (sql, [2]), (sql, [3])]
             self.assertEqual(TRN._queries, exp)
 
+    def test_add_prepare(self):
+        with TRN:
+            sql = "INSERT INTO ag.test_table (int_column) VALUES (%s)"
+            TRN.add(sql, [1], prepare='test_add_prepare')
+            TRN.add(sql, [[2], [3]], many=True, prepare='test_add_prepare')
+
+            stmts = [q[0] for q in TRN._queries]
+            self.assertEqual([q[1] for q in TRN._queries], [[1], [2], [3]])
+            self.assertTrue(isinstance(stmts[0], PreparedStatement))
+            self.assertEqual(stmts[0].name, 'test_add_prepare')
+            self.assertEqual(stmts[0].sql, sql)
+            # The registered statement is shared
+            self.assertTrue(stmts[0] is stmts[1] is stmts[2])
+
+            # Remove queries so __exit__ doesn't try to execute it
+            TRN._queries = []
+
+    def test_add_prepare_error(self):
+        with TRN:
+            TRN.add("SELECT %s", [1], prepare='test_add_prepare_error')
+            with self.assertRaises(ValueError):
+                TRN.add("SELECT %s + 1", [1], prepare='test_add_prepare_error')
+            with self.assertRaises(ValueError):
+                TRN.add("SELECT 1", prepare='not a name')
+            with self.assertRaises(ValueError):
+                TRN.add("SELECT %(foo)s", {'foo': 1},
+                        prepare='test_add_prepare_named')
+            TRN._queries = []
+
     def test_add_error(self):
         with TRN:
             with self.assertRaises(TypeError):
@@ -206,6 +242,91 @@ class TestTransaction(TestBase):
             # make sure rollback correctly
             self._assert_sql_equal([])
 
+    def test_execute_pipeline(self):
+        with TRN:
+            sql = """INSERT INTO ag.test_table (str_column, int_column)
+                     VALUES (%s, %s)"""
+            TRN.add(sql, ['insert1', 1])
+            TRN.add(sql, ['insert2', 2])
+            TRN.add("UPDATE ag.test_table SET bool_column = %s "
+                    "WHERE str_column = %s", [False, 'insert2'])
+            TRN.add("""SELECT str_column, int_column FROM ag.test_table
+                       ORDER BY int_column""")
+            TRN.add("DELETE FROM ag.test_table WHERE int_column = %s", [1])
+            TRN.add("SELECT COUNT(*) FROM ag.test_table")
+            obs = TRN.execute()
+            exp = [None, None, None, [['insert1', 1], ['insert2', 2]],
+                   None, [[1]]]
+            self.assertEqual(obs, exp)
+
+        self._assert_sql_equal([('insert2', False, 2)])
+
+    def test_execute_pipeline_error(self):
+        with TRN:
+            sql = """INSERT INTO ag.test_table (str_column, int_column)
+                     VALUES (%s, %s)"""
+            TRN.add(sql, ['insert1', 1])
+            TRN.add("INSERT INTO ag.table_to_make (the_trans_to_fail) "
+                    "VALUES (1)")
+            TRN.add(sql, ['insert2', 2])
+
+            with self.assertRaises(ValueError):
+                TRN.execute()
+
+            self._assert_sql_equal([])
+
+    def test_execute_many_bulk(self):
+        with TRN:
+            sql = """INSERT INTO ag.test_table (str_column, int_column)
+                     VALUES (%s, %s)"""
+            args = [['insert%d' % i, i] for i in range(250)]
+            TRN.add(sql, args, many=True)
+            TRN.add("""INSERT INTO ag.test_table (str_column, int_column)
+                       VALUES ('100%%', %s);""", [[250], [251]], many=True)
+            TRN.add("SELECT COUNT(*) FROM ag.test_table")
+            obs = TRN.execute()
+            self.assertEqual(obs, [None] * 252 + [[[252]]])
+            TRN.add("""SELECT str_column, int_column FROM ag.test_table
+                       WHERE int_column IN (0, 249, 251)
+                       ORDER BY int_column""")
+            obs = TRN.execute_fetchindex()
+            self.assertEqual(obs, [['insert0', 0], ['insert249', 249],
+                                   ['100%', 251]])
+
+    def test_execute_many_bulk_error(self):
+        with TRN:
+            sql = ("INSERT INTO ag.test_table (str_column, int_column) "
+                   "VALUES (%s, %s)")
+            TRN.add(sql, [['insert1', 1], ['insert2', None]], many=True)
+
+            with self.assertRaises(ValueError):
+                TRN.execute()
+
+            self._assert_sql_equal([])
+
+    def test_continues_insert(self):
+        sql = "INSERT INTO t (a, b) VALUES (%s, NOW())"
+        self.assertTrue(_continues_insert(sql, sql))
+        self.assertFalse(_continues_insert(None, sql))
+        self.assertFalse(_continues_insert(
+            sql, "INSERT INTO t (a, b) VALUES (%s, %s)"))
+        for sql in ["INSERT INTO t VALUES (%s) RETURNING a",
+                    "INSERT INTO t VALUES (%s) ON CONFLICT DO NOTHING",
+                    "INSERT INTO t VALUES (%s), (%s)",
+                    "INSERT INTO t SELECT %s",
+                    "UPDATE t SET a = %s"]:
+            self.assertFalse(_continues_insert(sql, sql))
+
+    def test_returns_no_rows(self):
+        self.assertTrue(_returns_no_rows("INSERT INTO t VALUES (%s)"))
+        self.assertTrue(_returns_no_rows(" update t SET a = 1;"))
+        self.assertTrue(_returns_no_rows("DELETE FROM t"))
+        self.assertFalse(_returns_no_rows("DELETE FROM t RETURNING a"))
+        self.assertFalse(_returns_no_rows("SELECT 1"))
+        self.assertFalse(_returns_no_rows("DELETE FROM t; SELECT 1"))
+        self.assertFalse(_returns_no_rows(
+            PreparedStatement('test_no_rows', "DELETE FROM t")))
+
     def test_execute_commit_false(self):
         with TRN:
             sql = """INSERT INTO ag.test_table (str_column, int_column)
@@ -312,9 +433,228 @@ class TestTransaction(TestBase):
             obs = TRN.execute_fetchflatten(idx=3)
             self.assertEqual(obs, ['insert1', 1, 'insert2', 2, 'insert3', 3])
 
+    def test_execute_row_type(self):
+        with TRN:
+            sql = """INSERT INTO ag.test_table (str_column, int_column)
+                     VALUES (%s, %s)"""
+            TRN.add(sql, [['insert1', 1], ['insert2', 2]], many=True)
+            sql = """SELECT str_column, int_column FROM ag.test_table
+                     ORDER BY int_column"""
+            TRN.add(sql)
+            TRN.add(sql, row_type='tuple')
+            TRN.add(sql, row_type='namedtuple')
+            obs = TRN.execute()
+
+            self.assertEqual(obs[2][0]['str_column'], 'insert1')
+            self.assertEqual(obs[3], [('insert1', 1), ('insert2', 2)])
+            self.assertEqual(type(obs[3][0]), tuple)
+            self.assertEqual(obs[4][1].str_column, 'insert2')
+            self.assertEqual(obs[4][1].int_column, 2)
+
+    def test_execute_row_type_fetch(self):
+        with TRN:
+            TRN.add("SELECT 42")
+            self.assertEqual(TRN._queries[0].row_type, 'dict')
+            TRN.add("SELECT 1, 2")
+            TRN.add("SELECT 3, 4")
+            TRN.add("SELECT 5")
+
+            # Only the pending query that is flattened is switched to tuples
+            TRN._use_tuples(1)
+            self.assertEqual([q.row_type for q in TRN._queries],
+                             ['dict', 'tuple', 'dict', 'dict'])
+            self.assertEqual(TRN.execute_fetchlast(), 5)
+            self.assertEqual(type(TRN._results[-1][0]), tuple)
+            self.assertEqual(TRN.execute_fetchflatten(idx=1), [1, 2])
+            self.assertEqual(TRN.execute_fetchindex(idx=2), [[3, 4]])
+
+    def test_add_row_type_error(self):
+        with TRN:
+            with self.assertRaises(ValueError):
+                TRN.add("SELECT 42", row_type='list')
+            self.assertEqual(TRN._queries, [])
+
+    def test_execute_iter(self):
+        self._populate_test_table()
+        with TRN:
+            TRN.add("DELETE FROM ag.test_table WHERE int_column = %s", [4])
+            sql = """SELECT str_column, int_column FROM ag.test_table
+                     WHERE int_column > %s ORDER BY int_column"""
+            obs = TRN.execute_iter(sql, [0], fetch_size=2)
+            # The queued queries are executed first
+            self.assertEqual(TRN._queries, [])
+            self.assertEqual(TRN._results, [None])
+            self.assertEqual(list(obs), [['test1', 1], ['test2', 2],
+                                         ['test3', 3]])
+
+            obs = TRN.execute_iter(sql, [1], row_type='namedtuple')
+            self.assertEqual([r.int_column for r in obs], [2, 3])
+            # The rows are not stored in the results
+            self.assertEqual(TRN._results, [None])
+            self.assertEqual(TRN._server_cursors, set())
+
+    def test_execute_iter_commit(self):
+        self._populate_test_table()
+        with TRN:
+            obs = TRN.execute_iter("SELECT * FROM ag.test_table",
+                                   row_type='tuple', fetch_size=1)
+            self.assertEqual(next(obs), ('test1', True, 1))
+            TRN.commit()
+            # The cursor is not closed again in the new transaction
+            obs.close()
+            TRN.add("SELECT COUNT(*) FROM ag.test_table")
+            self.assertEqual(TRN.execute_fetchlast(), 4)
+
+    def test_execute_iter_after_context(self):
+        self._populate_test_table()
+        with TRN:
+            obs = TRN.execute_iter("SELECT * FROM ag.test_table",
+                                   row_type='tuple', fetch_size=1)
+        with self.assertRaises(RuntimeError):
+            next(obs)
+
+        with TRN:
+            obs = TRN.execute_iter("SELECT * FROM ag.test_table",
+                                   row_type='tuple', fetch_size=1)
+            self.assertEqual(next(obs), ('test1', True, 1))
+        # The connection is not used once the transaction has ended
+        with TRN:
+            TRN.add("SELECT COUNT(*) FROM ag.test_table")
+            with self.assertRaises(RuntimeError):
+                next(obs)
+            self.assertEqual(TRN.execute_fetchlast(), 4)
+
+    def test_execute_iter_error(self):
+        with TRN:
+            with self.assertRaises(ValueError):
+                TRN.execute_iter("SELECT * FROM ag.table_that_does_not_exist")
+            with self.assertRaises(ValueError):
+                TRN.execute_iter("SELECT 42", row_type='list')
+
+    def test_copy_from(self):
+        self._populate_test_table()
+        with TRN:
+            TRN.add("DELETE FROM ag.test_table WHERE int_column = %s", [4])
+            obs = TRN.copy_from(
+                'ag.test_table', ['str_column', 'int_column'],
+                [('tab\tnew\nline', 5), ('back\\slash', 6)])
+            self.assertEqual(obs, 2)
+            # The queued queries are executed first
+            self.assertEqual(TRN._queries, [])
+            self.assertEqual(TRN._results, [None])
+
+        self._assert_sql_equal([('test1', True, 1), ('test2', True, 2),
+                                ('test3', False, 3),
+                                ('tab\tnew\nline', True, 5),
+                                ('back\\slash', True, 6)])
+
+    def test_copy_from_error(self):
+        with TRN:
+            with self.assertRaises(ValueError):
+                TRN.copy_from('ag.test_table', ['int_column'], [('foo',)])
+        self._assert_sql_equal([])
+
+    def test_execute_search_path(self):
+        with TRN:
+            TRN.add("SELECT current_schemas(false)")
+            self.assertEqual(TRN.execute_fetchlast(),
+                             ['ag', 'barcodes', 'public'])
+
+            # The search path survives a reset of the session settings
+            TRN.add("RESET ALL")
+            TRN.add("SELECT current_schemas(false)")
+            self.assertEqual(TRN.execute_fetchlast(),
+                             ['ag', 'barcodes', 'public'])
+
+    def test_execute_prepared(self):
+        sql = """INSERT INTO ag.test_table (str_column, int_column)
+                 VALUES (%s, %s) RETURNING str_column, int_column"""
+        with TRN:
+            TRN.add(sql, ['insert1', 1], prepare='test_execute_prepared')
+            TRN.add("SELECT int_column FROM ag.test_table WHERE int_column = 1"
+                    " AND str_column LIKE 'insert%%'",
+                    prepare='test_execute_prepared_select')
+            obs = TRN.execute()
+            self.assertEqual(obs, [[['insert1', 1]], [[1]]])
+            self.assertTrue({'test_execute_prepared',
+                             'test_execute_prepared_select'}.issubset(
+                                 TRN._connection.prepared))
+
+            # Statements are prepared again on new connections
+            TRN.commit()
+            TRN.close()
+            TRN._open_connection()
+            self.assertEqual(TRN._connection.prepared, set())
+            TRN.add(sql, ['insert2', 2], prepare='test_execute_prepared')
+            self.assertEqual(TRN.execute_fetchindex(), [['insert2', 2]])
+
+        self._assert_sql_equal([('insert1', True, 1), ('insert2', True, 2)])
+
+    def test_prepared_statement(self):
+        obs = PreparedStatement('foo', "SELECT %s, '%%', %s")
+        self.assertEqual(obs.prepare_sql, "PREPARE foo AS SELECT $1, '%', $2")
+        self.assertEqual(obs.execute_sql, "EXECUTE foo (%s, %s)")
+
+        obs = PreparedStatement('bar', "SELECT 42")
+        self.assertEqual(obs.prepare_sql, "PREPARE bar AS SELECT 42")
+        self.assertEqual(obs.execute_sql, "EXECUTE bar")
+
+    def test_execute_async(self):
+        with TRN:
+            TRN.add("SELECT 42")
+            self.assertEqual(TRN.execute_async().result(), [[[42]]])
+
+            TRN.add("SELECT 43")
+            self.assertEqual(TRN.execute_fetchlast_async().result(), 43)
+
+            TRN.add("SELECT 44")
+            self.assertEqual(TRN.execute_fetchindex_async(0).result(),
+                             [[42]])
+
+            TRN.add("SELECT 45")
+            self.assertEqual(TRN.execute_fetchflatten_async().result(), [45])
+
+    def test_run_async(self):
+        def func(value):
+            with TRN:
+                TRN.add("SELECT %s", [value])
+                return TRN.execute_fetchlast()
+
+        with TRN:
+            TRN.add("SELECT 1")
+            self.assertEqual(run_async(func, 42).result(), 42)
+            # The function used its own transaction
+            self.assertEqual(TRN._queries, [("SELECT 1", None)])
+
+    def test_run_async_saturated(self):
+        holding = Queue()
+        release = Event()
+
+        def func():
+            with TRN:
+                TRN.add("SELECT 1")
+                TRN.execute()
+                holding.put(True)
+                release.wait()
+
+        futures = [run_async(func) for _ in range(EXECUTOR._max_workers + 1)]
+        try:
+            # Every thread of the executor holds a connection
+            for _ in range(EXECUTOR._max_workers):
+                holding.get(timeout=10)
+            with patch.object(POOL, 'checkout_timeout', 1):
+                with TRN:
+                    TRN.add("SELECT 42")
+                    self.assertEqual(TRN.execute_fetchlast(), 42)
+        finally:
+            release.set()
+        for future in futures:
+            future.result()
+
     def test_context_manager_rollback(self):
         try:
             with TRN:
+                conn = TRN._connection
                 sql = """INSERT INTO ag.test_table (str_column, int_column)
                      VALUES (%s, %s) RETURNING str_column, int_column"""
                 args = [['insert1', 1], ['insert2', 2], ['insert3', 3]]
@@ -325,12 +665,12 @@ class TestTransaction(TestBase):
         except ValueError:
             pass
         self._assert_sql_equal([])
-        self.assertEqual(
-            TRN._connection.get_transaction_status(),
-            TRANSACTION_STATUS_IDLE)
+        self.assertEqual(conn.get_transaction_status(),
+                         TRANSACTION_STATUS_IDLE)
 
     def test_context_manager_execute(self):
         with TRN:
+            conn = TRN._connection
             sql = """INSERT INTO ag.test_table (str_column, int_column)
                  VALUES (%s, %s) RETURNING str_column, int_column"""
             args = [['insert1', 1], ['insert2', 2], ['insert3', 3]]
@@ -339,12 +679,12 @@ class TestTransaction(TestBase):
 
         self._assert_sql_equal([('insert1', True, 1), ('insert2', True, 2),
                                 ('insert3', True, 3)])
-        self.assertEqual(
-            TRN._connection.get_transaction_status(),
-            TRANSACTION_STATUS_IDLE)
+        self.assertEqual(conn.get_transaction_status(),
+                         TRANSACTION_STATUS_IDLE)
 
     def test_context_manager_no_commit(self):
         with TRN:
+            conn = TRN._connection
             sql = """INSERT INTO ag.test_table (str_column, int_column)
                  VALUES (%s, %s) RETURNING str_column, int_column"""
             args = [['insert1', 1], ['insert2', 2], ['insert3', 3]]
@@ -355,15 +695,15 @@ class TestTransaction(TestBase):
 
         self._assert_sql_equal([('insert1', True, 1), ('insert2', True, 2),
                                 ('insert3', True, 3)])
-        self.assertEqual(
-            TRN._connection.get_transaction_status(),
-            TRANSACTION_STATUS_IDLE)
+        self.assertEqual(conn.get_transaction_status(),
+                         TRANSACTION_STATUS_IDLE)
 
     def test_context_manager_multiple(self):
         self.assertEqual(TRN._contexts_entered, 0)
 
         with TRN:
             self.assertEqual(TRN._contexts_entered, 1)
+            conn = TRN._connection
 
             TRN.add("SELECT 42")
             with TRN:
@@ -385,9 +725,8 @@ class TestTransaction(TestBase):
         self.assertEqual(TRN._contexts_entered, 0)
         self._assert_sql_equal([('insert1', True, 1), ('insert2', True, 2),
                                 ('insert3', True, 3)])
-        self.assertEqual(
-            TRN._connection.get_transaction_status(),
-            TRANSACTION_STATUS_IDLE)
+        self.assertEqual(conn.get_transaction_status(),
+                         TRANSACTION_STATUS_IDLE)
 
     def test_context_manager_multiple_2(self):
         self.assertEqual(TRN._contexts_entered, 0)
@@ -404,6 +743,7 @@ class TestTransaction(TestBase):
 
         with TRN:
             self.assertEqual(TRN._contexts_entered, 1)
+            conn = TRN._connection
             sql = """INSERT INTO ag.test_table (str_column, int_column)
                          VALUES (%s, %s) RETURNING str_column, int_column"""
             args = [['insert1', 1], ['insert2', 2], ['insert3', 3]]
@@ -415,9 +755,8 @@ class TestTransaction(TestBase):
         self.assertEqual(TRN._contexts_entered, 0)
         self._assert_sql_equal([('insert1', True, 1), ('insert2', True, 2),
                                 ('insert3', True, 3)])
-        self.assertEqual(
-            TRN._connection.get_transaction_status(),
-            TRANSACTION_STATUS_IDLE)
+        self.assertEqual(conn.get_transaction_status(),
+                         TRANSACTION_STATUS_IDLE)
 
     def test_post_commit_funcs(self):
         fd, fp = mkstemp()
@@ -508,5 +847,130 @@ class TestTransaction(TestBase):
 
         self.assertEqual(TRN.index, 0)
 
+
+class TestTransactionBinding(TestCase):
+    def test_get_transaction(self):
+        obs = get_transaction()
+        self.assertTrue(isinstance(obs, Transaction))
+        self.assertTrue(get_transaction() is obs)
+
+    def test_get_transaction_threads(self):
+        obs = []
+        thread = Thread(target=lambda: obs.append(get_transaction()))
+        thread.start()
+        thread.join()
+        self.assertTrue(isinstance(obs[0], Transaction))
+        self.assertFalse(obs[0] is get_transaction())
+
+    def test_bind_transaction(self):
+        default = get_transaction()
+        trn = Transaction()
+        with bind_transaction(trn) as obs:
+            self.assertTrue(obs is trn)
+            self.assertTrue(get_transaction() is trn)
+            with bind_transaction() as inner:
+                self.assertFalse(inner is trn)
+                self.assertTrue(get_transaction() is inner)
+            self.assertTrue(get_transaction() is trn)
+        self.assertTrue(get_transaction() is default)
+
+    def test_proxy(self):
+        with bind_transaction() as trn:
+            with TRN:
+                self.assertEqual(trn._contexts_entered, 1)
+                TRN.add("SELECT 42")
+                self.assertEqual(trn._queries, [("SELECT 42", None)])
+                TRN._queries = []
+                self.assertEqual(trn._queries, [])
+            self.assertEqual(trn._contexts_entered, 0)
+
+
+class TestConnectionPool(TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(min_size=0, max_size=2, idle_timeout=300,
+                                   max_lifetime=3600, checkout_timeout=0.1)
+        # Connections checked out by the test, closed even if not returned
+        self._conns = []
+
+    def tearDown(self):
+        for conn in self._conns:
+            conn.close()
+        self.pool.closeall()
+
+    def _getconn(self, pool=None):
+        conn = (pool or self.pool).getconn()
+        self._conns.append(conn)
+        return conn
+
+    def test_init_error(self):
+        with self.assertRaises(ValueError):
+            ConnectionPool(0, 0, 300, 3600, 1)
+        with self.assertRaises(ValueError):
+            ConnectionPool(3, 2, 300, 3600, 1)
+
+    def test_getconn_putconn(self):
+        conn = self._getconn()
+        self.assertTrue(isinstance(conn, connection))
+        self.assertEqual(conn.closed, 0)
+        self.pool.putconn(conn)
+        # The connection is reused
+        self.assertTrue(self._getconn() is conn)
+
+    def test_getconn_exhausted(self):
+        self._getconn()
+        conn = self._getconn()
+        with self.assertRaises(RuntimeError):
+            self._getconn()
+        # Returning a connection frees a slot
+        self.pool.putconn(conn)
+        self.assertTrue(self._getconn() is conn)
+
+    def test_putconn_rollback(self):
+        conn = self._getconn()
+        with conn.cursor() as cur:
+            cur.execute("SELECT 42")
+        self.pool.putconn(conn)
+        self.assertEqual(conn.get_transaction_status(),
+                         TRANSACTION_STATUS_IDLE)
+
+    def test_putconn_close(self):
+        conn = self._getconn()
+        self.pool.putconn(conn, close=True)
+        self.assertNotEqual(conn.closed, 0)
+        self.assertFalse(self._getconn() is conn)
+
+    def test_getconn_discards_closed(self):
+        conn = self._getconn()
+        self.pool.putconn(conn)
+        conn.close()
+        obs = self._getconn()
+        self.assertFalse(obs is conn)
+        self.assertEqual(obs.closed, 0)
+
+    def test_max_lifetime(self):
+        pool = ConnectionPool(min_size=0, max_size=1, idle_timeout=300,
+                              max_lifetime=0, checkout_timeout=0.1)
+        conn = self._getconn(pool)
+        pool.putconn(conn)
+        self.assertNotEqual(conn.closed, 0)
+        obs = self._getconn(pool)
+        self.assertFalse(obs is conn)
+        pool.putconn(obs)
+
+    def test_idle_timeout(self):
+        pool = ConnectionPool(min_size=1, max_size=2, idle_timeout=0,
+                              max_lifetime=3600, checkout_timeout=0.1)
+        conn1 = self._getconn(pool)
+        conn2 = self._getconn(pool)
+        pool.putconn(conn1)
+        pool.putconn(conn2)
+        # min_size keeps the most recently used connection open
+        obs = self._getconn(pool)
+        self.assertTrue(obs is conn2)
+        self.assertNotEqual(conn1.closed, 0)
+        pool.putconn(obs)
+        pool.closeall()
+
+
 if __name__ == "__main__":
     main()
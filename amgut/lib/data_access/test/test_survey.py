@@ -1,5 +1,9 @@
 # coding: utf-8
 from unittest import TestCase, main
+from cPickle import dump, load
+from os import close, remove
+from os.path import exists, join, dirname, abspath
+from tempfile import mkstemp
 from string import ascii_letters
 from datetime import date
 from random import choice
@@ -7,8 +11,14 @@ from future.utils import viewitems
 from wtforms.form import BaseForm
 from amgut.connections import ag_data
 from amgut.lib.data_access.survey import (
-    QuestionSingle, QuestionMultiple, QuestionText, QuestionString, Group,
-    Survey)
+    Question, QuestionSingle, QuestionMultiple, QuestionText, QuestionString,
+    Group, Survey, load_surveys, build_snapshot)
+from amgut.lib.data_access.sql_connection import TRN, QUERY_STATS
+from amgut.lib.util import rollback
+
+# Used so the surveys are loaded from the database even if a snapshot exists
+MISSING_SNAPSHOT_FP = join(dirname(abspath(__file__)), 'missing',
+                           'survey_definitions.pkl')
 # Question
 
 
@@ -228,6 +238,12 @@ class TestGroup(TestCase):
         group = Group(1)
         self.assertEqual(group.american_name, 'General Information')
 
+    def test_create_non_existent(self):
+        with self.assertRaises(ValueError):
+            Group(-42)
+        with self.assertRaises(ValueError):
+            Question.factory(-42, 'General Information')
+
 
 class TestSurvey(TestCase):
     def test_create(self):
@@ -308,6 +324,25 @@ class TestSurvey(TestCase):
             'Pet_Information_144_0': 'REMOVED',
             'Pet_Information_145_0': 'Female: 50; Male: 59'})
 
+    def test_fetch_survey_single_query(self):
+        survey = Survey(2)
+        QUERY_STATS.reset()
+        obs = survey.fetch_survey('cb367dcf9a9af7e9')
+        self.assertEqual(sum(s['count'] for s in QUERY_STATS.summary()), 1)
+        self.assertEqual(obs['Pet_Information_135_0'], [1])
+        self.assertEqual(obs['Pet_Information_145_0'], 'Female: 50; Male: 59')
+
+    @rollback
+    def test_fetch_survey_other_precedence(self):
+        # Free text answers win over the other answers of their question
+        TRN.add("""INSERT INTO ag.survey_answers_other
+                   (survey_id, survey_question_id, response)
+                   VALUES ('cb367dcf9a9af7e9', 135, '["Free text"]')""")
+        TRN.execute()
+        obs = Survey(2).fetch_survey('cb367dcf9a9af7e9')
+        self.assertEqual(obs['Pet_Information_135_0'], 'Free text')
+        self.assertEqual(obs['Pet_Information_137_0'], [0])
+
     def test_fetch_survey_bad_id(self):
         survey = Survey(1)
         with self.assertRaises(ValueError):
@@ -461,5 +496,90 @@ class TestSurvey(TestCase):
         self.assertEqual(obs, consent)
 
 
+class TestLoadSurveys(TestCase):
+    def test_load_surveys(self):
+        obs = load_surveys([1, 2])
+        self.assertItemsEqual(obs, [1, 2])
+
+        exp = Survey(2)
+        self.assertEqual(obs[2].id, 2)
+        self.assertEqual([g.id for g in obs[2].groups],
+                         [g.id for g in exp.groups])
+        self.assertEqual(obs[2].question_types, exp.question_types)
+        self.assertEqual(obs[2].unspecified, 'Unspecified')
+        for qid, question in viewitems(exp.questions):
+            self.assertEqual(obs[2].questions[qid].__dict__.keys(),
+                             question.__dict__.keys())
+            self.assertEqual(obs[2].questions[qid].responses,
+                             question.responses)
+            self.assertEqual(obs[2].questions[qid].triggers,
+                             question.triggers)
+            self.assertEqual(obs[2].questions[qid].interface_element_ids,
+                             question.interface_element_ids)
+
+    def test_load_surveys_all(self):
+        QUERY_STATS.reset()
+        obs = load_surveys(snapshot_fp=MISSING_SNAPSHOT_FP)
+        self.assertItemsEqual(obs, [1, 2, 3, 4, 5])
+        # The number of queries does not depend on the number of questions
+        self.assertEqual(sum(s['count'] for s in QUERY_STATS.summary()), 7)
+
+    def test_load_surveys_non_existent(self):
+        with self.assertRaises(ValueError):
+            load_surveys([1, -42])
+
+
+class TestSnapshot(TestCase):
+    def setUp(self):
+        fd, self.snapshot_fp = mkstemp(suffix='.pkl')
+        close(fd)
+        remove(self.snapshot_fp)
+
+    def tearDown(self):
+        if exists(self.snapshot_fp):
+            remove(self.snapshot_fp)
+
+    def _count_queries(self, survey_ids):
+        QUERY_STATS.reset()
+        surveys = load_surveys(survey_ids, self.snapshot_fp)
+        self.assertItemsEqual(surveys, survey_ids)
+        return sum(s['count'] for s in QUERY_STATS.summary())
+
+    def test_load_surveys_snapshot(self):
+        # Missing snapshot
+        self.assertEqual(self._count_queries([2]), 7)
+
+        build_snapshot(self.snapshot_fp)
+        # Only the current patch is checked
+        self.assertEqual(self._count_queries([2]), 1)
+        self.assertEqual(self._count_queries([1, 2, 3, 4, 5]), 1)
+
+        obs = load_surveys([2], self.snapshot_fp)[2]
+        exp = Survey(2)
+        self.assertEqual(obs.question_types, exp.question_types)
+        self.assertEqual([g.name for g in obs.groups],
+                         [g.name for g in exp.groups])
+
+    def test_load_surveys_stale_snapshot(self):
+        build_snapshot(self.snapshot_fp)
+        with open(self.snapshot_fp, 'rb') as f:
+            snapshot = load(f)
+        snapshot['current_patch'] = 'unpatched'
+        with open(self.snapshot_fp, 'wb') as f:
+            dump(snapshot, f)
+        # The current patch is checked before falling back to the database
+        self.assertEqual(self._count_queries([2]), 8)
+
+        # An unreadable snapshot is discarded before the patch is checked
+        with open(self.snapshot_fp, 'wb') as f:
+            f.write('corrupt')
+        self.assertEqual(self._count_queries([2]), 7)
+
+        # So is a snapshot that lacks some of its keys
+        with open(self.snapshot_fp, 'wb') as f:
+            dump({'definitions': snapshot['definitions']}, f)
+        self.assertEqual(self._count_queries([2]), 7)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,80 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The American Gut Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+"""
+Hashing and verification of kit passwords
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from passlib.hash import bcrypt
+
+from amgut.lib.config_manager import AMGUT_CONFIG
+
+
+# Threads hashing and verifying passwords for asynchronous code. bcrypt
+# releases the GIL, so they run in parallel with the IOLoop, and bounding them
+# keeps a burst of logins from taking every CPU of the server
+EXECUTOR = ThreadPoolExecutor(max_workers=AMGUT_CONFIG.password_workers)
+
+
+def hash_password(password):
+    """Hashes a password with bcrypt
+
+    Parameters
+    ----------
+    password : str
+        The password
+
+    Returns
+    -------
+    str
+        The bcrypt hash of the password
+    """
+    return bcrypt.encrypt(password)
+
+
+def verify_password(password, hashed):
+    """Checks a password against its bcrypt hash
+
+    Parameters
+    ----------
+    password : str
+        The password
+    hashed : str
+        The bcrypt hash to check the password against
+
+    Returns
+    -------
+    bool
+        Whether the password matches the hash
+    """
+    return bcrypt.verify(password, hashed)
+
+
+def hash_password_async(password):
+    """Hashes a password without blocking the calling thread
+
+    Returns
+    -------
+    concurrent.futures.Future
+        Resolves to the value returned by `hash_password`. Tornado coroutines
+        can yield it directly
+    """
+    return EXECUTOR.submit(hash_password, password)
+
+
+def verify_password_async(password, hashed):
+    """Checks a password without blocking the calling thread
+
+    Returns
+    -------
+    concurrent.futures.Future
+        Resolves to the value returned by `verify_password`. Tornado
+        coroutines can yield it directly
+    """
+    return EXECUTOR.submit(verify_password, password, hashed)
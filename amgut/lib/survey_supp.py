@@ -1,7 +1,69 @@
-from amgut.lib.data_access.survey import Survey
+"""
+The surveys of the web portal. They are only built the first time one of them
+is used, so importing this module does not touch the database
+"""
 
-primary_human_survey = Survey(1)
-primary_animal_survey = Survey(2)
-fermented_survey = Survey(3)
-surf_survey = Survey(4)
-personal_microbiome_survey = Survey(5)
+from threading import Lock
+
+from amgut.lib.data_access.survey import load_surveys
+
+
+class _SurveyRegistry(object):
+    """Builds all the surveys the first time one is requested and keeps them"""
+    def __init__(self):
+        self._lock = Lock()
+        self._surveys = None
+
+    def get(self, survey_id):
+        """Returns a survey, building all the surveys if needed
+
+        Parameters
+        ----------
+        survey_id : int
+            The ID of the survey in the database
+
+        Returns
+        -------
+        amgut.lib.data_access.survey.Survey
+            The survey
+
+        Raises
+        ------
+        ValueError
+            If the survey does not exist
+        """
+        surveys = self._surveys
+        if surveys is None:
+            with self._lock:
+                if self._surveys is None:
+                    # Building every survey at once takes as many queries as
+                    # building a single one
+                    self._surveys = load_surveys()
+                surveys = self._surveys
+
+        if survey_id not in surveys:
+            raise ValueError("Survey does not exist: %s" % survey_id)
+        return surveys[survey_id]
+
+    def reload(self):
+        """Discards the built surveys, so they are built again on next use"""
+        with self._lock:
+            self._surveys = None
+
+
+class _LazySurvey(object):
+    """Stands for a survey of the registry, which is built on first use"""
+    def __init__(self, survey_id):
+        self._survey_id = survey_id
+
+    def __getattr__(self, name):
+        return getattr(surveys.get(self._survey_id), name)
+
+
+surveys = _SurveyRegistry()
+
+primary_human_survey = _LazySurvey(1)
+primary_animal_survey = _LazySurvey(2)
+fermented_survey = _LazySurvey(3)
+surf_survey = _LazySurvey(4)
+personal_microbiome_survey = _LazySurvey(5)
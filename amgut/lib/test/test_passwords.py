@@ -0,0 +1,22 @@
+from unittest import TestCase, main
+
+from amgut.lib.passwords import (hash_password, verify_password,
+                                 hash_password_async, verify_password_async)
+
+
+class TestPasswords(TestCase):
+    def test_hash_password(self):
+        hashed = hash_password('test')
+        self.assertTrue(hashed.startswith('$2'))
+        self.assertNotEqual(hash_password('test'), hashed)
+        self.assertTrue(verify_password('test', hashed))
+        self.assertFalse(verify_password('wrongPass', hashed))
+
+    def test_async(self):
+        hashed = hash_password_async('test').result()
+        self.assertTrue(verify_password_async('test', hashed).result())
+        self.assertFalse(verify_password_async('wrongPass', hashed).result())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+from unittest import TestCase, main
+from functools import partial
+from os.path import join, dirname, abspath
+
+from mock import patch
+
+from amgut.lib import survey_supp
+from amgut.lib.data_access.survey import Survey
+
+
+# Used so the surveys are loaded from the database even if a snapshot exists
+MISSING_SNAPSHOT_FP = join(dirname(abspath(__file__)), 'missing',
+                           'survey_definitions.pkl')
+
+
+class TestSurveyRegistry(TestCase):
+    def setUp(self):
+        self.registry = survey_supp._SurveyRegistry()
+        patcher = patch('amgut.lib.survey_supp.load_surveys',
+                        wraps=partial(survey_supp.load_surveys,
+                                      snapshot_fp=MISSING_SNAPSHOT_FP))
+        self.load = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get(self):
+        obs = self.registry.get(2)
+        self.assertIsInstance(obs, Survey)
+        self.assertEqual(obs.id, 2)
+        # The survey is only built once
+        self.assertIs(self.registry.get(2), obs)
+        # All the surveys are built at once
+        self.assertEqual(self.registry.get(5).id, 5)
+        self.load.assert_called_once_with()
+
+        self.registry.reload()
+        self.assertIsNot(self.registry.get(2), obs)
+        self.assertEqual(self.load.call_count, 2)
+
+    def test_lazy_survey(self):
+        survey = survey_supp._LazySurvey(3)
+        self.assertFalse(self.load.called)
+        with patch.object(survey_supp, 'surveys', self.registry):
+            self.assertEqual(survey.id, 3)
+            self.assertEqual(survey.groups, self.registry.get(3).groups)
+        self.load.assert_called_once_with()
+
+    def test_get_non_existent(self):
+        with self.assertRaises(ValueError):
+            self.registry.get(-42)
+
+
+if __name__ == '__main__':
+    main()
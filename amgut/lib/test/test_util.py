@@ -1,6 +1,7 @@
 from unittest import TestCase, main
 from amgut.lib.util import (survey_fermented, survey_surf, survey_vioscreen,
-                            survey_asd, rollback)
+                            survey_asd, rollback, make_survey_class)
+from amgut.lib.data_access.survey import Group
 from amgut.lib.data_access.ag_data_access import AGDataAccess
 
 
@@ -73,6 +74,20 @@ class TestUtil(TestCase):
         obs = self.ag_data.getAGKitDetails(kit)
         self.assertEqual(obs['kit_verified'], 'n')
 
+    def test_make_survey_class(self):
+        group = Group(1)
+        obs = make_survey_class(group, 'HumanSurvey')
+        self.assertEqual(obs.__name__, 'HumanSurvey')
+        self.assertEqual(obs.prompts['General_Information_23_0'],
+                         'What is your highest level of education?')
+        self.assertEqual(obs.supplemental_eids, group.supplemental_eids)
+
+        # The class is shared by all the callers
+        self.assertIs(make_survey_class(group, 'HumanSurvey'), obs)
+        self.assertIsNot(make_survey_class(group, 'SecondarySurvey'), obs)
+        # but built again if the group is reloaded
+        self.assertIsNot(make_survey_class(Group(1), 'HumanSurvey'), obs)
+
 
 if __name__ == '__main__':
     main()
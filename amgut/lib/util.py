@@ -10,12 +10,13 @@ import urlparse
 
 from json import loads, dumps
 from collections import defaultdict
+from threading import Lock
 
 from future.utils import viewitems
 from tornado.escape import url_escape
 from wtforms import Form
 
-from amgut import media_locale, text_locale
+from amgut import media_locale, text_locale, AMGUT_CONFIG
 from amgut.lib.data_access.sql_connection import TRN
 from amgut.connections import redis
 from amgut.lib.vioscreen import encrypt_key
@@ -44,6 +45,12 @@ class PartitionResponse(object):
         d[qid] = value
 
 
+# Form classes built by make_survey_class, keyed by the group id, the form
+# type and the locale. Each entry also holds the group it was built from
+_survey_classes = {}
+_survey_classes_lock = Lock()
+
+
 def make_survey_class(group, survey_type):
     """Creates a form class for a group of questions
 
@@ -52,7 +59,24 @@ def make_survey_class(group, survey_type):
 
     Select fields are generated for questions that require a single response,
     and sets of checkboxes for questions that can have multiple responses
+
+    Notes
+    -----
+    The classes are built once and shared by all the requests. A class is
+    built again if the survey definitions are reloaded, as the group is then a
+    different object.
     """
+    key = (group.id, survey_type, AMGUT_CONFIG.locale)
+    with _survey_classes_lock:
+        cached = _survey_classes.get(key)
+        if cached is None or cached[0] is not group:
+            cached = (group, _build_survey_class(group, survey_type))
+            _survey_classes[key] = cached
+    return cached[1]
+
+
+def _build_survey_class(group, survey_type):
+    """Builds the form class of make_survey_class"""
     attrs = {}
     prompts = {}
     triggers = defaultdict(list)
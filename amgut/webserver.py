@@ -3,7 +3,7 @@
 from os.path import dirname, join
 
 from tornado.httpserver import HTTPServer
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado.web import Application
 from tornado.options import define, options, parse_command_line
 
@@ -47,6 +47,7 @@ from amgut.handlers.download import DownloadHandler
 from amgut.handlers.open_humans import (OpenHumansHandler,
                                         OpenHumansLoginHandler)
 from amgut.lib.startup_tests import startup_tests
+from amgut.lib.data_access.sql_connection import QUERY_STATS
 
 define("port", default=8888, help="run on the given port", type=int)
 
@@ -121,6 +122,9 @@ def main():
     parse_command_line()
     http_server = HTTPServer(AGWebApplication())
     http_server.listen(options.port)
+    if AMGUT_CONFIG.query_stats_interval > 0:
+        PeriodicCallback(QUERY_STATS.log_summary,
+                         AMGUT_CONFIG.query_stats_interval * 1000).start()
     print("Tornado started on port", options.port)
     IOLoop.instance().start()
 
@@ -64,6 +64,7 @@ setup(name='American Gut participant UI',
       install_requires=[
           'click==3.3',
           'future==0.13.1',
+          'futures',
           'open-humans-tornado-oauth2==2.1.0',
           'passlib==1.6.2',
           'psycopg2',